@@ -0,0 +1,181 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import itertools
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy.special import ndtr
+from scipy.stats import poisson
+
+import data
+import models
+import pricing
+
+MODELS = {
+    'poisson': models.PoissonRegression,
+    'bayesian': models.BayesianRegression,
+}
+
+# Leaderboard metrics where higher is better; the rest rank ascending
+HIGHER_IS_BETTER = {'log_likelihood', 'hit_rate'}
+
+def refit_windows(n, dates=None, refit_every=1, refit_by='rows', min_train=1):
+    """Split rows min_train..n into (train_end, pred_end) walk-forward windows.
+
+    Each window fits on rows [:train_end] and predicts rows [train_end:pred_end].
+    refit_by='rows' refits every `refit_every` rows; refit_by='day' refits at the
+    start of every `refit_every`-th calendar day, so a day's rows are predicted from
+    earlier days only. Rows must be in date order.
+    """
+    if refit_by == 'day':
+        days = np.asarray(dates, dtype='datetime64[D]')
+        starts = np.flatnonzero(days[1:] != days[:-1]) + 1
+        starts = [int(s) for s in starts if s >= min_train][::refit_every]
+    elif refit_by == 'rows':
+        starts = list(range(min_train, n, refit_every))
+    else:
+        raise ValueError(f"Unknown refit_by: {refit_by}")
+    return list(zip(starts, starts[1:] + [n]))
+
+def _run_windows(X, Y, windows, model_type, warm_start, model_kwargs):
+    # Returns (lam, sigma); sigma is None for Poisson models, which predict lam only
+    lams, sigmas = [], []
+    model = None
+    for train_end, pred_end in windows:
+        if warm_start:
+            model_kwargs = dict(model_kwargs, warm_start=model)
+        model = MODELS[model_type](X[:train_end], Y[:train_end], **model_kwargs)
+        pred = model.predict(X[train_end:pred_end])
+        if isinstance(pred, tuple):
+            pred, sigma = pred
+            sigmas.append(sigma)
+        lams.append(pred)
+    lam = np.concatenate(lams) if lams else np.empty(0)
+    return lam, np.concatenate(sigmas) if sigmas else None
+
+def evaluate(lam, Y, lines=None, sigma=None):
+    """Score predictions of Y: Poisson(lam), or Normal(lam, sigma) if sigma is given.
+
+    The normal log likelihood is of the unit interval around each (integer) label, so
+    it is comparable with the Poisson log pmf.
+    """
+    if sigma is None:
+        log_likelihood = poisson.logpmf(Y, lam)
+    else:
+        log_likelihood = np.log(np.maximum(ndtr((Y + 0.5 - lam) / sigma) - ndtr((Y - 0.5 - lam) / sigma), np.finfo(np.float64).tiny))
+    report = {
+        'rows': len(Y),
+        'mae': float(np.mean(np.abs(Y - lam))),
+        'log_likelihood': float(np.mean(log_likelihood)),
+    }
+    if lines is not None:
+        # Bet the side the model favours; pushes (label exactly on the line) are not counted
+        lines = np.broadcast_to(np.asarray(lines, dtype=np.float64), Y.shape)
+        if sigma is None:
+            p_over, p_under, _ = pricing.poisson_prices(lam, lines)
+        else:
+            p_over, p_under, _ = pricing.normal_prices(lam, sigma, lines)
+        bet_over = p_over > p_under
+        settled = Y != lines
+        won = np.where(bet_over, Y > lines, Y < lines)[settled]
+        report['bets'] = int(settled.sum())
+        report['hit_rate'] = float(won.mean()) if len(won) else float('nan')
+    return report
+
+def walk_forward(X, Y, dates=None, model_type='poisson', refit_every=1, refit_by='rows',
+                 warm_start=False, workers=1, lines=None, min_train=1, **model_kwargs):
+    """Walk-forward backtest: predict each row from a model fit only on earlier rows.
+
+    With refit_every=1 and refit_by='rows' this is models.simulate_poisson. Windows are
+    split into `workers` contiguous blocks evaluated in parallel; warm starts chain
+    within a block (Poisson models only). Returns (report, lam) where lam holds
+    predictions (the mean, for BayesianRegression) for Y[min_train:] (or from the first
+    refit day onwards).
+    """
+    if dates is not None:
+        order = np.argsort(dates, kind='stable')
+        X, Y, dates = X[order], Y[order], np.asarray(dates)[order]
+        if lines is not None and np.ndim(lines):
+            lines = np.asarray(lines)[order]
+    if warm_start and model_type != 'poisson':
+        raise ValueError(f"{model_type} models can't be warm started")
+    windows = refit_windows(len(Y), dates, refit_every, refit_by, min_train)
+    if not windows:
+        raise ValueError("Not enough rows to backtest")
+    if workers > 1:
+        blocks = [list(block) for block in np.array_split(np.arange(len(windows)), min(workers, len(windows)))]
+        with ProcessPoolExecutor(max_workers=len(blocks)) as pool:
+            futures = [
+                pool.submit(_run_windows, X, Y, [windows[i] for i in block], model_type, warm_start, model_kwargs)
+                for block in blocks
+            ]
+            results = [f.result() for f in futures]
+        lam = np.concatenate([r[0] for r in results])
+        sigma = np.concatenate([r[1] for r in results]) if results[0][1] is not None else None
+    else:
+        lam, sigma = _run_windows(X, Y, windows, model_type, warm_start, model_kwargs)
+    first = windows[0][0]
+    if lines is not None and np.ndim(lines):
+        lines = np.asarray(lines)[first:]
+    report = evaluate(lam, Y[first:], lines, sigma)
+    report['fits'] = len(windows)
+    return report, lam
+
+def sweep_grid(model_types, alphas, feature_lists):
+    """Sweep configurations: every model type x regularization x feature list.
+
+    `feature_lists` maps a name (e.g. the features file) to its features. `alphas` is
+    PoissonRegression's L2 strength; BayesianRegression fits its own regularization by
+    evidence maximization, so it gets one configuration per feature list.
+    """
+    grid = []
+    for model_type, (name, features) in itertools.product(model_types, feature_lists.items()):
+        if model_type not in MODELS:
+            raise ValueError(f"Unknown model type: {model_type}")
+        for alpha in (alphas if model_type == 'poisson' else [None]):
+            grid.append({'model_type': model_type, 'alpha': alpha, 'feature_list': name, 'features': list(features)})
+    return grid
+
+def _sweep_worker(matrix_dir, columns, config, backtest_kwargs):
+    # Opens the shared matrix read-only; only this configuration's columns are copied
+    X_all = np.load(os.path.join(matrix_dir, 'X.npy'), mmap_mode='r')
+    Y_all = np.load(os.path.join(matrix_dir, 'Y.npy'), mmap_mode='r')
+    dates = np.load(os.path.join(matrix_dir, 'dates.npy'), mmap_mode='r')
+    cols = [columns.index(f) for f in config['features']]
+    X = X_all[:, cols]
+    # Same rows load_dataset would keep for this feature list
+    keep = np.isfinite(X).all(axis=1) & np.isfinite(Y_all) & ~np.isnat(dates)
+    model_kwargs = {} if config['alpha'] is None else {'alpha': config['alpha']}
+    if config['model_type'] != 'poisson':
+        backtest_kwargs = dict(backtest_kwargs, warm_start=False)
+    report, _ = walk_forward(X[keep], np.asarray(Y_all[keep]), np.asarray(dates[keep]), model_type=config['model_type'], **backtest_kwargs, **model_kwargs)
+    return report
+
+def sweep(features_path, grid, workers=None, rank_by='log_likelihood', **backtest_kwargs):
+    """Walk-forward backtest every configuration of `grid` (see sweep_grid) in parallel.
+
+    The features file is read once for the union of all feature lists and saved as .npy
+    files the workers memory-map read-only, so each process shares one copy of the
+    matrix instead of receiving it pickled. Configurations are spread over `workers`
+    processes, each running its walk_forward serially. Returns the leaderboard, ranked
+    best first by `rank_by`.
+    """
+    if rank_by == 'hit_rate' and backtest_kwargs.get('lines') is None:
+        raise ValueError("Ranking by hit_rate needs lines")
+    columns = list(dict.fromkeys(f for config in grid for f in config['features']))
+    df = data.read_feature_columns(features_path, columns + ['label', 'date'])
+    with tempfile.TemporaryDirectory(prefix='sweep_') as matrix_dir:
+        np.save(os.path.join(matrix_dir, 'X.npy'), df[columns].to_numpy(dtype=np.float64))
+        np.save(os.path.join(matrix_dir, 'Y.npy'), df['label'].to_numpy(dtype=np.float64))
+        np.save(os.path.join(matrix_dir, 'dates.npy'), pd.to_datetime(df['date']).values)
+        del df
+        rows = []
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(grid))) as pool:
+            futures = {pool.submit(_sweep_worker, matrix_dir, columns, config, backtest_kwargs): config for config in grid}
+            for future in as_completed(futures):
+                config = futures[future]
+                rows.append({k: v for k, v in config.items() if k != 'features'} | {'n_features': len(config['features'])} | future.result())
+    leaderboard = pd.DataFrame(rows)
+    leaderboard = leaderboard.sort_values(rank_by, ascending=rank_by not in HIGHER_IS_BETTER, kind='stable').reset_index(drop=True)
+    leaderboard.index += 1
+    return leaderboard
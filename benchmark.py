@@ -0,0 +1,182 @@
+"""Benchmarks of the data and model hot paths on synthetic match data.
+
+For each scale, generates (once, cached in the work directory) a synthetic.py CSV with
+that many games and times read_data, HistoryIndex, FeatureExtractor.extract, both
+compute_features engines, load_dataset and simulate_poisson. Each benchmark is timed,
+then re-run under tracemalloc for its peak Python/NumPy heap use. Results are written
+as JSON; --compare fails on any benchmark slower than a previous results file by more
+than the tolerance. Usage:
+
+    python benchmark.py [--games 1000 10000 100000] [--compare OLD.json]
+"""
+import argparse
+from datetime import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+import data
+import models
+import synthetic
+from features import FeatureExtractor, NotEnoughDataException
+from history import HistoryIndex
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+LABEL = 'kills'
+# Below this, timings are too noisy to flag as regressions
+MIN_COMPARE_SECONDS = 0.05
+
+def _measure(fn, memory):
+    gc.collect()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    peak = None
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+def _latest_features_file():
+    return max(glob.glob(os.path.join('checkpoints', '*', 'features.*')), key=os.path.getmtime)
+
+def run_scale(games, args, features):
+    # Runs in a per-scale work directory since compute_features writes ./checkpoints
+    scale_dir = os.path.join(args.workdir, f'games_{games}_seed_{args.seed}')
+    os.makedirs(scale_dir, exist_ok=True)
+    os.chdir(scale_dir)
+    path = 'matches.csv'
+    if not os.path.exists(path):
+        print(f'Generating {games} games...', flush=True)
+        synthetic.write_csv(games, f'{path}.tmp', args.seed)
+        os.replace(f'{path}.tmp', path)
+    data.read_data(path)  # builds the feather cache outside the timings
+
+    results = []
+    def bench(name, fn, items):
+        result, seconds, peak = _measure(fn, not args.no_memory)
+        n = items(result) if callable(items) else items
+        results.append({
+            'games': games, 'benchmark': name, 'seconds': seconds,
+            'peak_mb': peak / 2**20 if peak is not None else None,
+            'items': n, 'items_per_sec': n / seconds if seconds > 0 else None,
+        })
+        print(f"{games:>8} {name:<28} {seconds:9.3f}s"
+              + (f" {peak / 2**20:9.1f} MB" if peak is not None else '') + f" {n:>9} items", flush=True)
+        return result
+
+    df = bench('read_data_csv', lambda: data.read_data(path, cache=False), len)
+    bench('read_data_cache', lambda: data.read_data(path), len)
+    history = bench('history_index', lambda: HistoryIndex(df), len(df))
+
+    # Rows from the last tenth of the schedule, so most have a full history
+    recent = history.df[(history.df.index >= len(history.df) * 9 // 10) & (history.df['playername'] != 'unknown player')]
+    sample = recent.sample(min(args.extract_games, len(recent)), random_state=args.seed)
+    inputs = [data._game_from_history(history, row) for _, row in sample.iterrows()]
+    def extract_all():
+        values = []
+        for game in inputs:
+            try:
+                fe = FeatureExtractor(history, game)
+                values.append([fe.extract(f) for f in features])
+            except NotEnoughDataException:
+                continue
+        return values
+    bench('feature_extractor_extract', extract_all, len(inputs))
+
+    # The loop engine walks the whole frame but only extracts the last --loop-games games
+    loop_start = df['date'].iloc[-min(args.loop_games * 10, len(df))]
+    bench('compute_features_loop', lambda: data.compute_features(df, loop_start, df['date'].iloc[-1], LABEL, features),
+          int((df['date'] >= loop_start).sum()))
+    bench('compute_features_vectorized', lambda: data.compute_features_vectorized(df, df['date'].iloc[0], df['date'].iloc[-1], LABEL, features),
+          len(df))
+    features_path = _latest_features_file()
+    X, Y = bench('load_dataset', lambda: data.load_dataset(features_path, features), lambda r: len(r[1]))
+
+    rows = min(args.simulate_rows, len(Y))
+    bench('simulate_poisson', lambda: models.simulate_poisson(X[:rows], Y[:rows]), rows)
+    os.chdir(REPO_DIR)
+    return results
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, 'r') as f:
+        baseline = {(r['games'], r['benchmark']): r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        old = baseline.get((r['games'], r['benchmark']))
+        if old is None:
+            continue
+        ratio = r['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+        slower = ratio > 1 + tolerance and r['seconds'] > MIN_COMPARE_SECONDS
+        if slower:
+            regressions.append(r)
+        print(f"{'SLOWER' if slower else 'ok    '} {r['games']:>8} {r['benchmark']:<28} {old['seconds']:9.3f}s -> {r['seconds']:9.3f}s ({ratio:.2f}x)")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the data and model hot paths on synthetic data')
+    parser.add_argument('--games', type=int, nargs='+', default=[1000, 10000, 100000], help='Scales to run, in games')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the synthetic data and sampling')
+    parser.add_argument('--workdir', type=str, default=os.path.join(REPO_DIR, '.bench'), help='Where generated data and outputs are kept')
+    parser.add_argument('--output', type=str, default=None, help='Results JSON path (default: a timestamped file in --workdir)')
+    parser.add_argument('--extract-games', type=int, default=200, help='Rows timed through FeatureExtractor.extract')
+    parser.add_argument('--loop-games', type=int, default=100, help='Games extracted by the loop compute_features engine')
+    parser.add_argument('--simulate-rows', type=int, default=300, help='Rows walked by simulate_poisson, which is quadratic')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc re-runs')
+    parser.add_argument('--compare', type=str, default=None, help='Previous results JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed slowdown ratio over --compare')
+    args = parser.parse_args()
+    # run_scale changes directory, so resolve user paths up front
+    args.workdir = os.path.abspath(args.workdir)
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+
+    features = data.get_features(os.path.join(REPO_DIR, 'features.txt'))
+    results = []
+    for games in args.games:
+        results.extend(run_scale(games, args, features))
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(),
+            'commit': _git_commit(),
+            'seed': args.seed,
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sklearn': sklearn.__version__,
+        },
+        'results': results,
+    }
+    output = args.output or os.path.join(args.workdir, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {output}')
+    if args.compare and compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
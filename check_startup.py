@@ -0,0 +1,62 @@
+"""Import-time regression check for the main.py CLI.
+
+Runs each light command in a fresh interpreter, reports its wall time and the
+`-X importtime` total, and fails if any heavy module got imported or a command is
+over budget. Usage: python check_startup.py [--budget SECONDS] [--runs N]
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ['pandas', 'numpy', 'sklearn', 'scipy', 'matplotlib', 'pyarrow', 'streamlit']
+
+# Commands that should never need the heavy modules
+LIGHT_COMMANDS = [
+    ['--help'],
+    ['extract', '--help'],
+    ['backtest', '--help'],
+    ['inference', '--help'],
+]
+
+PROBE = """
+import runpy, sys
+sys.argv = ['main.py'] + sys.argv[1:]
+try:
+    runpy.run_path('main.py', run_name='__main__')
+except SystemExit:
+    pass
+sys.stderr.write('HEAVY:' + ','.join(m for m in {heavy!r} if m in sys.modules) + '\\n')
+"""
+
+def run_command(args):
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(heavy=HEAVY_MODULES), *args],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True)
+    elapsed = time.perf_counter() - start
+    heavy = re.search(r'^HEAVY:(.*)$', proc.stderr, re.MULTILINE).group(1)
+    # importtime lines: "import time: self [us] | cumulative | imported package"
+    import_us = sum(int(m.group(1)) for m in re.finditer(r'^import time:\s+(\d+)\s+\|', proc.stderr, re.MULTILINE))
+    return elapsed, import_us / 1e6, [m for m in heavy.split(',') if m]
+
+def main():
+    parser = argparse.ArgumentParser(description='Check main.py startup time and imports')
+    parser.add_argument('--budget', type=float, default=0.5, help='Max wall time per command in seconds')
+    parser.add_argument('--runs', type=int, default=3, help='Runs per command; the best is reported')
+    args = parser.parse_args()
+
+    failed = False
+    for command in LIGHT_COMMANDS:
+        results = [run_command(command) for _ in range(args.runs)]
+        elapsed, import_s, heavy = min(results, key=lambda r: r[0])
+        ok = not heavy and elapsed <= args.budget
+        failed |= not ok
+        print(f"{'ok  ' if ok else 'FAIL'} main.py {' '.join(command):<20} {elapsed:.3f}s wall, {import_s:.3f}s imports"
+              + (f", heavy imports: {', '.join(heavy)}" if heavy else ''))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,40 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from dataclasses import dataclass
 from datetime import datetime
+import glob
+import hashlib
+import json
 import logging
 import pandas as pd
 import os
+import shutil
+import unicodedata
 import numpy as np
+import pyarrow as pa
+from pyarrow import feather
+import pyarrow.compute as pc
 
-from features import FeatureExtractor, NotEnoughDataException
-from labels import LabelExtractor
+from features import FEATURE_SPECS, FeatureExtractor, NotEnoughDataException, compute_feature_frame, feature_spec
+from history import HistoryIndex
+from labels import LABEL_COLUMNS, LabelExtractor, label_column, label_columns, label_names
+from metrics import ExtractionMetrics
+import shared
 
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Bump when the cached frame's layout changes so stale caches are rebuilt
+CACHE_VERSION = 1
+
+# Extraction output: a Feather file whose schema metadata under FEATURES_META_KEY lists
+# the features, labels and date range (see feature_file_meta)
+FEATURES_FILE = 'features.feather'
+FEATURES_FILE_VERSION = 1
+FEATURES_META_KEY = 'lolbetting'
+
+KEY_COLUMNS = ['gameid', 'participantid', 'date', 'playername', 'teamname', 'position']
+CATEGORICAL_COLUMNS = ['gameid', 'playername', 'teamname', 'position']
+
 @dataclass
 class Input:
     date: datetime
@@ -34,53 +58,297 @@ def _game_from_df(df, df_row):
         position=df_row['position'],
     )
 
-def compute_features(df, start_date, end_date, label, features=None, save_freq=25000):
+def _game_from_history(history, df_row):
+    return _game_from_df(history.df.iloc[history.game_rows(df_row['gameid'])], df_row)
+
+def _make_checkpoint_dir():
+    # Microseconds keep back-to-back runs apart; an existing directory is never reused
+    checkpoint_path = os.path.join(os.getcwd(), f"checkpoints/checkpoint_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}")
+    os.makedirs(checkpoint_path)
+    return checkpoint_path
+
+def _arrow_table(df):
+    # Floats keep NaN as a value (not a null) so load_dataset can view them without a
+    # copy; all-missing columns become null-typed so parts written separately unify
+    arrays = {}
+    for column in df.columns:
+        col = df[column]
+        if col.dtype == object and len(col) and col.isna().all():
+            arrays[column] = pa.nulls(len(col))
+        elif col.dtype.kind == 'f':
+            arrays[column] = pa.array(col.to_numpy(), from_pandas=False)
+        else:
+            arrays[column] = pa.Array.from_pandas(col)
+    return pa.table(arrays)
+
+def _feature_meta(features, label, dates):
+    # Header of a features file: what it holds and the date range of its rows
+    dates = pd.to_datetime(pd.Series(dates))
+    return {
+        'version': FEATURES_FILE_VERSION,
+        'features': list(features),
+        'labels': label_names(label),
+        'start_date': dates.min().isoformat() if len(dates) else None,
+        'end_date': dates.max().isoformat() if len(dates) else None,
+        'rows': len(dates),
+    }
+
+def _write_features(table, path, meta=None):
+    # Uncompressed Arrow IPC (Feather v2), so readers can memory-map it
+    if meta is not None:
+        table = table.replace_schema_metadata({FEATURES_META_KEY: json.dumps(meta)})
+    feather.write_feather(table, f"{path}.tmp", compression='uncompressed')
+    os.replace(f"{path}.tmp", path)
+
+def _read_part(path, dtypes=None):
+    # Checkpoint parts. Runs resumed from before the columnar format have CSV shards,
+    # and the shards they had left are Feather files under their old .csv names
+    with open(path, 'rb') as f:
+        is_arrow = f.read(6) == b'ARROW1'
+    if is_arrow:
+        return feather.read_table(path, memory_map=True)
+    df = pd.read_csv(path, low_memory=False)
+    return _arrow_table(df.astype(dtypes) if dtypes else df)
+
+def _merge_features(paths, out_path, features, label, dtypes=None):
+    """Concatenate checkpoint parts into one features file with its metadata header."""
+    table = pa.concat_tables([_read_part(path, dtypes) for path in paths], promote_options='permissive')
+    # Parts where a column was all missing leave nulls behind; floats get NaN back instead
+    for i, field in enumerate(table.schema):
+        if pa.types.is_null(field.type):
+            table = table.set_column(i, field.name, pa.array(np.full(len(table), np.nan)))
+        elif pa.types.is_floating(field.type) and table.column(i).null_count:
+            table = table.set_column(i, field.name, pc.fill_null(table.column(i), np.nan))
+    meta = _feature_meta(features, label, table.column('date').to_numpy() if len(table) else [])
+    _write_features(table, out_path, meta)
+
+def _output_dtypes(df, features, label):
+    # Column -> dtype of a features file: the match data's own, float features and each
+    # label column taking its source column's, as compute_features_vectorized copies them
+    dtypes = df.dtypes.to_dict()
+    dtypes.update({name: np.dtype(np.float64) for name in features})
+    names = label_names(label)
+    for column, name in zip(label_columns(label), [names[0]] + names):
+        dtypes[column] = df.dtypes[LABEL_COLUMNS[name][0]]
+    return dtypes
+
+def _typed_frame(rows, dtypes):
+    # Rows rebuilt from game.to_dict() lose categoricals and narrow ints; put them back
+    return pd.DataFrame(rows, columns=list(dtypes)).astype(dtypes)
+
+def _extract_row(history, game, features, le, label, metrics=None):
+    fe = FeatureExtractor(history, _game_from_history(history, game), metrics=metrics)
+    preds = [fe.extract(f) for f in features]
+    game_dict = game.to_dict()
+    game_dict.update({features[j]: preds[j] for j in range(len(preds))})
+    game_dict.update(le.extract_all(game, label))
+    return game_dict
+
+def _skip_reason(e, metrics):
+    # Expected skips carry their reason; anything else is logged with a traceback once per type
+    if isinstance(e, NotEnoughDataException):
+        return str(e) or 'not enough history'
+    reason = f"error: {type(e).__name__}"
+    if reason not in metrics.skips:
+        logger.exception(f"Skipping row after unexpected {type(e).__name__}, further ones are only counted")
+    return reason
+
+def compute_features(df, start_date, end_date, label, features=None, save_freq=25000, metrics=None):
+    # label: one label name or several (see labels.label_names), all written in this pass;
+    # metrics: optional metrics.ExtractionMetrics filled in with timings and skip counts
     mod_df = []
     le = LabelExtractor()
     ct = 0
-    checkpoint_path = os.path.join(os.getcwd(), f"checkpoints/checkpoint_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
-    os.makedirs(checkpoint_path, exist_ok=True)
-    for _, game in df.iterrows():
+    checkpoint_path = _make_checkpoint_dir()
+    history = HistoryIndex(df)
+    if not features:
+        features = list(FEATURE_SPECS.keys())
+    dtypes = _output_dtypes(df, features, label)
+    checkpt_files = []
+    target = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    metrics.total = len(target) if metrics.total is None else metrics.total
+    for _, game in target.iterrows():
+        if game['playername'] == 'unknown player':
+            metrics.row_done('unknown player')
+            continue
         try:
-            if start_date > game['date'] or game['date'] > end_date:
-                continue
-            if game['playername'] == 'unknown player':
-                logging.warn("Unknown player, skipping...")
-                continue
-            fe = FeatureExtractor(df, _game_from_df(df, game))
-            if not features:
-                features = list(fe.name2func.keys())
-            try:
-                preds = [fe.extract(f) for f in features]
-            except NotEnoughDataException:
-                logging.warn(f"Skipping. Not enough data for player: {game['playername']} date: {game['date']} gameid: {game['gameid']}")
-                continue
-            game_dict = game.to_dict()
-            game_dict.update({features[j]: preds[j] for j in range(len(preds))})
-            game_dict['label'] = le.extract(game, label)
-            mod_df.append(game_dict)
-
-            logger.info(f"Extracted features for player: {game['playername']} date: {game['date']} gameid: {game['gameid']}")
-            ct += 1
-            if ct > 0 and ct % save_freq == 0:
-                cpath = os.path.join(checkpoint_path, f"features_{ct}.csv")
-                logger.info(f"Saving features to disk: {cpath}")
-                pd.DataFrame(mod_df).to_csv(cpath)
-                mod_df.clear()
+            mod_df.append(_extract_row(history, game, features, le, label, metrics))
         except Exception as e:
-            logger.error(f"{e}")
+            logger.debug(f"Skipping player: {game['playername']} date: {game['date']} gameid: {game['gameid']}: {e}")
+            metrics.row_done(_skip_reason(e, metrics))
             continue
-    pd.DataFrame(mod_df).to_csv(os.path.join(checkpoint_path, f"features_{ct}.csv"))
+        metrics.row_done()
+
+        ct += 1
+        if ct > 0 and ct % save_freq == 0:
+            cpath = os.path.join(checkpoint_path, f"features_{ct}.feather")
+            logger.info(f"Saving features to disk: {cpath}")
+            _write_features(_arrow_table(_typed_frame(mod_df, dtypes)), cpath)
+            checkpt_files.append(cpath)
+            mod_df.clear()
+    if mod_df or not checkpt_files:
+        cpath = os.path.join(checkpoint_path, f"features_{ct}.feather")
+        _write_features(_arrow_table(_typed_frame(mod_df, dtypes)), cpath)
+        checkpt_files.append(cpath)
     logging.info("Combining checkpoint files...")
-    dfs = []
-    for checkpt_file in [f for f in os.listdir(checkpoint_path) if f.endswith('.csv')]:
-        dfs.append(pd.read_csv(os.path.join(checkpoint_path, checkpt_file)))
-    all_features = pd.concat(dfs, ignore_index=True)
-    all_features.to_csv(os.path.join(checkpoint_path, f"features.csv"))
+    _merge_features(checkpt_files, os.path.join(checkpoint_path, FEATURES_FILE), features, label)
+    logger.info(metrics.summary())
     logging.info(f"Saved features master file")
 
+def _shard_bounds(dates, shards):
+    unique_dates = np.unique(dates.to_numpy(dtype='datetime64[ns]'))
+    if not len(unique_dates):
+        return []
+    return [
+        (pd.Timestamp(chunk[0]).isoformat(), pd.Timestamp(chunk[-1]).isoformat())
+        for chunk in np.array_split(unique_dates, min(shards, len(unique_dates)))
+    ]
+
+def _write_json(obj, path):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2)
+    os.replace(tmp_path, path)
+
+_worker_history = None
+
+def _init_worker(shared_df_path):
+    # Workers attach to the frame the parent published instead of each unpickling a copy
+    global _worker_history
+    _worker_history = HistoryIndex(shared.attach(shared_df_path))
+
+def _extract_shard(shard, features, label, out_path, dtypes):
+    # Runs in a pool worker against the history it loaded at startup. `dtypes` come from
+    # the parent's frame, since the shared copy turns object columns into categoricals
+    history = _worker_history
+    le = LabelExtractor()
+    dates = history.df['date']
+    in_shard = (dates >= pd.Timestamp(shard['start'])) & (dates <= pd.Timestamp(shard['end']))
+    target = history.df[in_shard]
+    metrics = ExtractionMetrics(total=len(target))
+    rows = []
+    for _, game in target.iterrows():
+        if game['playername'] == 'unknown player':
+            metrics.row_done('unknown player')
+            continue
+        try:
+            rows.append(_extract_row(history, game, features, le, label, metrics))
+        except Exception as e:
+            metrics.row_done(_skip_reason(e, metrics))
+            continue
+        metrics.row_done()
+    _write_features(_arrow_table(_typed_frame(rows, dtypes)), out_path)
+    return metrics.to_dict()
+
+def compute_features_parallel(df, start_date, end_date, label, features=None, workers=None, shards=None, checkpoint_path=None, metrics=None):
+    """Sharded compute_features over a process pool.
+
+    Target rows are split into date-range shards, each written to its own checkpoint
+    file. manifest.json records finished shards and their metrics, so calling again
+    with the same checkpoint_path resumes where a crashed run stopped; the dates,
+    label and features must match the ones the checkpoint was started with.
+    """
+    workers = workers or os.cpu_count()
+    if not features:
+        features = list(FEATURE_SPECS.keys())
+    dtypes = _output_dtypes(df, features, label)
+    checkpoint_path = checkpoint_path or _make_checkpoint_dir()
+    os.makedirs(checkpoint_path, exist_ok=True)
+    manifest_path = os.path.join(checkpoint_path, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if label_names(manifest['label']) != label_names(label) or manifest['features'] != features:
+            raise ValueError(f"Checkpoint {checkpoint_path} was started with a different label or feature list")
+        started = (pd.Timestamp(manifest['start_date']), pd.Timestamp(manifest['end_date']))
+        if started != (pd.Timestamp(start_date), pd.Timestamp(end_date)):
+            raise ValueError(f"Checkpoint {checkpoint_path} was started for {started[0]} to {started[1]}, "
+                             f"not {pd.Timestamp(start_date)} to {pd.Timestamp(end_date)}")
+        logger.info(f"Resuming {checkpoint_path}: {sum(s['done'] for s in manifest['shards'])}/{len(manifest['shards'])} shards done")
+    else:
+        target_dates = df['date'][(df['date'] >= start_date) & (df['date'] <= end_date)]
+        manifest = {
+            'start_date': pd.Timestamp(start_date).isoformat(),
+            'end_date': pd.Timestamp(end_date).isoformat(),
+            'label': label_names(label),
+            'features': features,
+            'shards': [
+                {'id': i, 'start': lo, 'end': hi, 'file': f"shard_{i:05d}.feather", 'done': False, 'rows': 0, 'skipped': 0}
+                for i, (lo, hi) in enumerate(_shard_bounds(target_dates, shards or workers * 4))
+            ],
+        }
+        _write_json(manifest, manifest_path)
+
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    in_range = (df['date'] >= pd.Timestamp(manifest['start_date'])) & (df['date'] <= pd.Timestamp(manifest['end_date']))
+    metrics.total = int(in_range.sum()) if metrics.total is None else metrics.total
+    for shard in manifest['shards']:
+        if shard['done'] and 'metrics' in shard:
+            metrics.merge(shard['metrics'])
+        elif shard['done']:
+            # Manifests written before shard metrics were recorded only have totals
+            metrics.add_rows(shard['rows'], {'not enough history': shard['skipped']})
+    pending = [s for s in manifest['shards'] if not s['done']]
+    if pending:
+        shared_df_path = shared.publish(df, shared.shared_path({'extract': os.path.abspath(checkpoint_path)}, os.getpid()))
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_worker, initargs=(shared_df_path,)) as pool:
+                futures = {
+                    pool.submit(_extract_shard, shard, features, label, os.path.join(checkpoint_path, shard['file']), dtypes): shard
+                    for shard in pending
+                }
+                for future in as_completed(futures):
+                    shard = futures[future]
+                    shard['metrics'] = future.result()
+                    shard['rows'], shard['skipped'] = shard['metrics']['extracted'], sum(shard['metrics']['skips'].values())
+                    shard['done'] = True
+                    _write_json(manifest, manifest_path)
+                    metrics.merge(shard['metrics'])
+                    logger.info(f"Finished shard {shard['id']} ({shard['start']} - {shard['end']}): {shard['rows']} rows; {metrics.progress_line()}")
+        finally:
+            os.remove(shared_df_path)
+
+    logging.info("Combining shard files...")
+    shard_files = [os.path.join(checkpoint_path, s['file']) for s in manifest['shards']]
+    if not shard_files:
+        # Nothing dated in range: an empty file with the columns the loop engine writes
+        shard_files = [os.path.join(checkpoint_path, 'shard_empty.feather')]
+        _write_features(_arrow_table(_typed_frame([], dtypes)), shard_files[0])
+    _merge_features(shard_files, os.path.join(checkpoint_path, FEATURES_FILE), features, label, dtypes)
+    logger.info(metrics.summary())
+    logging.info(f"Saved features master file")
+    return checkpoint_path
+
+def compute_features_vectorized(df, start_date, end_date, label, features=None, metrics=None):
+    # Same output as compute_features, computed for the whole frame in one pass
+    le = LabelExtractor()
+    checkpoint_path = _make_checkpoint_dir()
+    if not features:
+        features = list(FEATURE_SPECS.keys())
+    feature_df, valid = compute_feature_frame(df, features)
+    in_range = (df['date'] >= start_date) & (df['date'] <= end_date)
+    unknown = in_range & (df['playername'] == 'unknown player')
+    target = in_range & ~unknown
+    keep = target & valid
+    if metrics is None:
+        metrics = ExtractionMetrics()
+    metrics.total = int(in_range.sum()) if metrics.total is None else metrics.total
+    # The mask does not say which side lacked history, so these share one reason
+    metrics.add_rows(int(keep.sum()), {'unknown player': int(unknown.sum()), 'not enough history': int((target & ~valid).sum())})
+    logger.info(metrics.summary())
+    mod_df = pd.concat([df[keep], feature_df[keep]], axis=1)
+    for column, values in le.extract_all(mod_df, label).items():
+        mod_df[column] = values
+    mod_df = mod_df.astype(_output_dtypes(df, features, label))
+    meta = _feature_meta(features, label, mod_df['date'])
+    _write_features(_arrow_table(mod_df), os.path.join(checkpoint_path, FEATURES_FILE), meta)
+    logger.info(f"Saved features master file with {len(mod_df)} rows")
+
 def update_master_features(features_path, features):
-    new_features_df = pd.read_csv(features_path)[features + ['label']]
+    new_features_df = read_feature_columns(features_path)[features + ['label']]
     master_file = "./master_features.csv"
     if os.path.exists(master_file):
         master_df = pd.read_csv(master_file)
@@ -89,30 +357,446 @@ def update_master_features(features_path, features):
     updated_master_df = pd.concat([master_df, new_features_df]).drop_duplicates(subset=['gameid', 'playername'], keep='last')
     updated_master_df.to_csv(master_file, index=False)
 
-def load_dataset(features_path, features):
-    df = pd.read_csv(features_path)[features + ['label']]
-    # print(df.isna().sum().sort_values(ascending=False).head(20))
+def _is_feather(path):
+    # A features file, or a directory of parts written by append_features
+    return path.endswith('.feather') or os.path.isdir(path)
+
+def _feature_parts(path):
+    if not os.path.isdir(path):
+        return [path]
+    parts = sorted(glob.glob(os.path.join(path, 'part-*.feather')))
+    if not parts:
+        raise ValueError(f"No feature parts in {path}")
+    return parts
+
+def _part_meta(path):
+    metadata = pa.ipc.open_file(pa.memory_map(path, 'r')).schema.metadata or {}
+    raw = metadata.get(FEATURES_META_KEY.encode())
+    return json.loads(raw) if raw else None
+
+def feature_file_meta(path):
+    """Metadata header of a features file (see _feature_meta); None for CSV or older files.
+
+    For a directory of parts the date range and row count cover all of them.
+    """
+    if not _is_feather(path):
+        return None
+    metas = [_part_meta(part) for part in _feature_parts(path)]
+    if any(meta is None for meta in metas):
+        return None
+    starts = [meta['start_date'] for meta in metas if meta['start_date']]
+    ends = [meta['end_date'] for meta in metas if meta['end_date']]
+    return dict(
+        metas[0],
+        start_date=min(starts, key=pd.Timestamp, default=None),
+        end_date=max(ends, key=pd.Timestamp, default=None),
+        rows=sum(meta['rows'] for meta in metas),
+    )
+
+def append_features(df, out_dir, features, label):
+    """Add `df` to the features directory `out_dir` as a new part with its own header.
+
+    Readers take the directory wherever they take a features file. A part must have the
+    features and labels of the ones already there. Returns the part's path, or None
+    when `df` is empty.
+    """
+    if df.empty:
+        return None
+    os.makedirs(out_dir, exist_ok=True)
+    parts = sorted(glob.glob(os.path.join(out_dir, 'part-*.feather')))
+    if parts:
+        meta = _part_meta(parts[-1]) or {}
+        if meta.get('features') != list(features) or meta.get('labels') != label_names(label):
+            raise ValueError(f"{out_dir} holds features {meta.get('features')} with labels {meta.get('labels')}, "
+                             f"not {list(features)} with {label_names(label)}")
+    path = os.path.join(out_dir, f"part-{len(parts):05d}.feather")
+    _write_features(_arrow_table(df), path, _feature_meta(features, label, df['date']))
+    return path
+
+def _open_features(path, columns):
+    # Memory-mapped table of just `columns`, checked against each part's header
+    tables = []
+    for part in _feature_parts(path):
+        schema = pa.ipc.open_file(pa.memory_map(part, 'r')).schema
+        missing = [column for column in columns if column not in schema.names]
+        if missing:
+            meta = _part_meta(part) or {}
+            raise ValueError(f"{part} has no columns {missing} (features: {meta.get('features')}, labels: {meta.get('labels')})")
+        tables.append(feather.read_table(part, columns=columns, memory_map=True))
+    return pa.concat_tables(tables, promote_options='permissive')
+
+def _column_view(batch, column):
+    # float numpy view over a mapped column of one record batch; copies only ints or nulls
+    col = batch.column(column)
+    if col.null_count == 0 and pa.types.is_floating(col.type):
+        return col.to_numpy(zero_copy_only=True)
+    return col.to_numpy(zero_copy_only=False).astype(np.float64)
+
+def _finite_rows(batches, columns):
+    # One mask per record batch, True where every column is finite
+    masks = []
+    for batch in batches:
+        mask = np.ones(batch.num_rows, dtype=bool)
+        for column in columns:
+            mask &= np.isfinite(_column_view(batch, column))
+        masks.append(mask)
+    return masks
+
+def _gather(batches, columns, masks, dtype):
+    # Kept rows written straight into one contiguous array, batch by batch, column by column
+    out = np.empty((sum(int(mask.sum()) for mask in masks), len(columns)), dtype=dtype)
+    start = 0
+    # A narrower dtype is cast on the way in; only dropped rows can be NaN or inf there
+    with np.errstate(invalid='ignore', over='ignore'):
+        for batch, mask in zip(batches, masks):
+            stop = start + int(mask.sum())
+            for j, column in enumerate(columns):
+                np.compress(mask, _column_view(batch, column), out=out[start:stop, j])
+            start = stop
+    return out
+
+def _gather_dates(batches, masks):
+    dates = [np.compress(mask, batch.column('date').to_numpy(zero_copy_only=False).astype('datetime64[ns]')) for batch, mask in zip(batches, masks)]
+    return np.concatenate(dates) if dates else np.empty(0, dtype='datetime64[ns]')
+
+def read_feature_columns(path, columns=None):
+    """DataFrame of `columns` (all if None) from a CSV or Feather features file or directory."""
+    if _is_feather(path):
+        if columns is None:
+            columns = feather.read_table(_feature_parts(path)[0], memory_map=True).column_names
+        return _open_features(path, columns).to_pandas(split_blocks=True)
+    return pd.read_csv(path, usecols=columns, low_memory=False)
+
+def load_dataset(features_path, features, return_dates=False, label=None, dtype=np.float64):
+    # label: which label to use as Y from a multi-label file; the 'label' column by default.
+    # Rows with a missing or infinite feature or target are dropped
+    target = 'label' if label is None else label_column(label)
+    if _is_feather(features_path):
+        batches = _open_features(features_path, features + [target] + (['date'] if return_dates else [])).to_batches()
+        masks = _finite_rows(batches, features + [target])
+        if return_dates:
+            for batch, mask in zip(batches, masks):
+                mask &= batch.column('date').is_valid().to_numpy(zero_copy_only=False)
+        X = _gather(batches, features, masks, dtype)
+        Y = _gather(batches, [target], masks, np.float64)[:, 0]
+        if return_dates:
+            return X, Y, _gather_dates(batches, masks)
+        return X, Y
+    df = pd.read_csv(features_path, usecols=features + [target] + (['date'] if return_dates else []))
     df = df.dropna()
-    df = df[~np.isinf(df).any(axis=1)]
-    X, Y = df[features].values, df['label'].values
-    return X, Y 
+    df = df[~np.isinf(df[features + [target]]).any(axis=1)]
+    X, Y = df[features].to_numpy(dtype=dtype), df[target].values
+    if return_dates:
+        return X, Y, pd.to_datetime(df['date']).values
+    return X, Y
+
+def load_targets(features_path, features, labels, dtype=np.float64):
+    """Feature matrix plus one target per label from a file written with several labels.
+
+    Rows need finite features only; a target is NaN where its own label is missing, so
+    each model can drop just those rows (see models.MultiPoissonRegression).
+    """
+    names = label_names(labels)
+    if _is_feather(features_path):
+        batches = _open_features(features_path, features + [label_column(name) for name in names]).to_batches()
+        masks = _finite_rows(batches, features)
+        X = _gather(batches, features, masks, dtype)
+        return X, {name: _gather(batches, [label_column(name)], masks, np.float64)[:, 0] for name in names}
+    df = pd.read_csv(features_path, usecols=features + [label_column(name) for name in names])
+    df = df[np.isfinite(df[features]).all(axis=1)]
+    X = df[features].to_numpy(dtype=dtype)
+    Ys = {name: df[label_column(name)].to_numpy(dtype=np.float64) for name in names}
+    return X, Ys
+
+def features_digest(path):
+    # sha1 of a features file, or of its parts' digests for a directory
+    if not os.path.isdir(path):
+        return file_digest(path)
+    digest = hashlib.sha1()
+    for part in _feature_parts(path):
+        digest.update(file_digest(part).encode())
+    return digest.hexdigest()
+
+def dataset_fingerprint(features_path, X, Y):
+    # Identifies the training data a model artifact was fit on
+    return {
+        'features_path': os.path.abspath(features_path),
+        'sha1': features_digest(features_path),
+        'rows': int(X.shape[0]),
+        'feature_means': [float(v) for v in X.mean(axis=0)],
+        'label_mean': float(Y.mean()),
+    }
 
 def get_features(features_path='./features.txt'):
     with open(features_path, 'r') as f:
         features = f.read().split('\n')
     return features
 
+DATE_FORMATS = ("%m/%d/%y %H:%M", "%Y-%m-%d %H:%M:%S")
+
 def parse_date(date_str):
-    for fmt in ("%m/%d/%y %H:%M", "%Y-%m-%d %H:%M:%S"):
+    for fmt in DATE_FORMATS:
         try:
             return pd.to_datetime(date_str, format=fmt)
         except ValueError:
             continue
     return pd.NaT
 
-def read_data(path):
-    df = pd.read_csv(path)
-    df['date'] = df['date'].apply(parse_date)
+def parse_dates(date_strs):
+    # Vectorized parse_date: first matching format wins, NaT otherwise
+    parsed = pd.Series(pd.NaT, index=date_strs.index, dtype='datetime64[ns]')
+    for fmt in DATE_FORMATS:
+        parsed = parsed.fillna(pd.to_datetime(date_strs, format=fmt, errors='coerce'))
+    return parsed
+
+def file_digest(path, block_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_paths(path):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.cache')
+    name = os.path.basename(path)
+    return cache_dir, os.path.join(cache_dir, f"{name}.feather"), os.path.join(cache_dir, f"{name}.json")
+
+def _cache_is_fresh(path, meta_path):
+    # size + mtime is the fast path; a touched but unchanged file is confirmed by hash
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    stat = os.stat(path)
+    if meta.get('version') != CACHE_VERSION or meta['size'] != stat.st_size:
+        return False
+    if meta['mtime'] == stat.st_mtime:
+        return True
+    if meta['sha1'] != file_digest(path):
+        return False
+    meta['mtime'] = stat.st_mtime
+    _write_json(meta, meta_path)
+    return True
+
+def _read_csv(path, columns=None):
+    usecols = (lambda c: c in columns) if columns else None
+    df = pd.read_csv(path, usecols=usecols, low_memory=False)
+    df['date'] = parse_dates(df['date'])
     df = df.dropna(subset=['playername', 'date'])
-    df.sort_values(by='date', inplace=True)
-    return df
\ No newline at end of file
+    df.sort_values(by='date', inplace=True, kind='stable')
+    return df
+
+def columns_for_features(features=None, labels=LABEL_COLUMNS.keys()):
+    # Key columns plus the raw stats behind `features` (all of them if None) and `labels`
+    features = features or FEATURE_SPECS.keys()
+    stats = [feature_spec(f)[1] for f in features] + [c for label in labels for c in LABEL_COLUMNS[label]]
+    return list(dict.fromkeys(KEY_COLUMNS + stats))
+
+def _downcast(col):
+    for dtype in (np.int8, np.int16, np.int32, np.float32):
+        if np.issubdtype(dtype, np.integer) and (col.isna().any() or not np.issubdtype(col.dtype, np.number)):
+            continue
+        try:
+            cast = col.astype(dtype)
+        except (ValueError, OverflowError, TypeError):
+            continue
+        if np.array_equal(cast.to_numpy(dtype=np.float64), col.to_numpy(dtype=np.float64), equal_nan=True):
+            return cast
+    return col
+
+def compact_frame(df):
+    """Key strings to categoricals, numeric stats to the smallest dtype that holds them exactly."""
+    df = df.copy()
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS:
+            df[column] = df[column].astype('category')
+        elif pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]):
+            df[column] = _downcast(df[column])
+    return df
+
+def memory_report(before, after):
+    report = pd.DataFrame({
+        'dtype_before': before.dtypes.astype(str),
+        'bytes_before': before.memory_usage(index=False, deep=True),
+        'dtype_after': after.dtypes.astype(str).reindex(before.columns).fillna('dropped'),
+        'bytes_after': after.memory_usage(index=False, deep=True).reindex(before.columns).fillna(0).astype(int),
+    })
+    report.loc['total'] = ['', report['bytes_before'].sum(), '', report['bytes_after'].sum()]
+    return report
+
+def _is_seasons(path):
+    # A list of paths or a glob, which read_data merges with read_seasons
+    return not isinstance(path, (str, os.PathLike)) or glob.has_magic(path)
+
+def read_data(path, columns=None, compact=False, cache=True):
+    """Load OraclesElixir match data, dates parsed and sorted.
+
+    `columns` projects the frame (see columns_for_features) and compact=True applies
+    compact_frame. With cache=True the full parsed frame is kept as an uncompressed
+    Feather file under .cache/ next to the CSV and memory-mapped on later loads, so a
+    projection only touches the selected columns. The cache is rebuilt when the CSV's
+    size, mtime and sha1 no longer match. A list of paths or a glob goes through
+    read_seasons instead, which always caches.
+    """
+    if _is_seasons(path):
+        return read_seasons(path, columns, compact)
+    if not cache:
+        df = _read_csv(path, columns)
+        return compact_frame(df) if compact else df
+    cache_dir, cache_path, meta_path = _cache_paths(path)
+    if os.path.exists(cache_path) and _cache_is_fresh(path, meta_path):
+        table = feather.read_table(cache_path, memory_map=True)
+    else:
+        logger.info(f"Building data cache for {path}")
+        stat = os.stat(path)
+        table = pa.Table.from_pandas(_read_csv(path), preserve_index=True)
+        os.makedirs(cache_dir, exist_ok=True)
+        feather.write_feather(table, f"{cache_path}.tmp", compression='uncompressed')
+        os.replace(f"{cache_path}.tmp", cache_path)
+        _write_json({'version': CACHE_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_digest(path)}, meta_path)
+    if columns:
+        table = table.select([c for c in table.column_names if c in columns or c.startswith('__index_level_')])
+    df = table.to_pandas()
+    return compact_frame(df) if compact else df
+
+# Multi-season reads: each season CSV is parsed in chunks of CSV_CHUNK_ROWS into a
+# per-season cache of Feather parts, then merged MERGE_CHUNK_ROWS at a time into one
+# deduplicated, date-sorted store, so only one chunk of raw rows is in memory at once
+CSV_CHUNK_ROWS = 100_000
+MERGE_CHUNK_ROWS = 50_000
+SEASONS_VERSION = 1
+DEDUP_COLUMNS = ['gameid', 'participantid']
+# Optional JSON object of old team name -> new team name, applied by read_seasons
+TEAM_ALIASES_PATH = './team_aliases.json'
+
+def expand_data_paths(paths):
+    # A path, a glob, or a list of either -> existing files, each glob sorted by name
+    paths = [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+    expanded = []
+    for path in paths:
+        matches = sorted(glob.glob(path)) if glob.has_magic(path) else [path]
+        if not matches:
+            raise FileNotFoundError(f"No data files match {path}")
+        expanded.extend(m for m in matches if m not in expanded)
+    return expanded
+
+def data_version(paths):
+    # Cheap change token for a set of data files, e.g. to invalidate a snapshot
+    return tuple(os.stat(path).st_mtime_ns for path in expand_data_paths(paths))
+
+def _clean_team_name(name):
+    return ' '.join(unicodedata.normalize('NFKC', name).split())
+
+def team_name_map(names, aliases=None):
+    """Raw team name -> canonical name, given every name in date order.
+
+    Names are NFKC-normalized with whitespace collapsed, spellings differing only in
+    case become the most recent spelling, then `aliases` (old name -> new name, e.g.
+    for sponsor renames) is applied.
+    """
+    names = pd.Series(pd.unique(names.dropna()), dtype=object)
+    cleaned = names.map(_clean_team_name)
+    latest = dict(zip(cleaned.str.casefold(), cleaned))
+    canonical = cleaned.str.casefold().map(latest)
+    aliases = {_clean_team_name(k).casefold(): _clean_team_name(v) for k, v in (aliases or {}).items()}
+    canonical = canonical.map(lambda name: aliases.get(name.casefold(), name))
+    return dict(zip(names, canonical))
+
+def load_team_aliases(path=TEAM_ALIASES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _parts_paths(path):
+    parts_dir = os.path.join(_cache_paths(path)[0], f"{os.path.basename(path)}.parts")
+    return parts_dir, f"{parts_dir}.json"
+
+def _season_parts(path):
+    """Memory-mapped table of one season CSV, built chunk by chunk on first use."""
+    parts_dir, meta_path = _parts_paths(path)
+    if not (os.path.isdir(parts_dir) and _cache_is_fresh(path, meta_path)):
+        logger.info(f"Building chunked data cache for {path}")
+        stat = os.stat(path)
+        shutil.rmtree(parts_dir, ignore_errors=True)
+        shutil.rmtree(f"{parts_dir}.tmp", ignore_errors=True)
+        os.makedirs(f"{parts_dir}.tmp")
+        for i, chunk in enumerate(pd.read_csv(path, chunksize=CSV_CHUNK_ROWS, low_memory=False)):
+            chunk['date'] = parse_dates(chunk['date'])
+            chunk = chunk.dropna(subset=['playername', 'date'])
+            # All-missing columns become null-typed so they unify with any other part
+            for column in chunk.columns[chunk.isna().all().to_numpy()]:
+                chunk[column] = None
+            feather.write_feather(pa.Table.from_pandas(chunk, preserve_index=False), os.path.join(f"{parts_dir}.tmp", f"part-{i:05d}.feather"), compression='uncompressed')
+        os.replace(f"{parts_dir}.tmp", parts_dir)
+        _write_json({'version': CACHE_VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_digest(path)}, meta_path)
+    tables = [feather.read_table(os.path.join(parts_dir, name), memory_map=True) for name in sorted(os.listdir(parts_dir))]
+    return pa.concat_tables(tables, promote_options='permissive')
+
+def _merge_seasons(tables, out_path, aliases=None):
+    # Only the key columns are loaded whole; the rows themselves are gathered in slices
+    combined = pa.concat_tables(tables, promote_options='permissive')
+    keys = combined.select(DEDUP_COLUMNS + ['date', 'teamname']).to_pandas()
+    # A game published in several files keeps its row from the last file given
+    keys = keys[~keys.duplicated(DEDUP_COLUMNS, keep='last')]
+    keys = keys.iloc[np.argsort(keys['date'].to_numpy(), kind='stable')]
+    teams = team_name_map(keys['teamname'], aliases)
+    order = keys.index.to_numpy()
+    team_field = combined.schema.field('teamname')
+    team_column = combined.schema.get_field_index('teamname')
+    with pa.OSFile(f"{out_path}.tmp", 'wb') as sink, pa.ipc.new_file(sink, combined.schema) as writer:
+        for start in range(0, len(order), MERGE_CHUNK_ROWS):
+            chunk = combined.take(order[start:start + MERGE_CHUNK_ROWS])
+            renamed = pa.array(chunk.column('teamname').to_pandas().map(teams), type=team_field.type)
+            writer.write_table(chunk.set_column(team_column, team_field, renamed))
+    os.replace(f"{out_path}.tmp", out_path)
+
+def read_seasons(paths, columns=None, compact=False, team_aliases=None):
+    """Load several OraclesElixir season files as one frame, dates parsed and sorted.
+
+    `paths` is a list of CSVs and/or globs. Seasons are cached and merged out of core
+    (see _season_parts and _merge_seasons): rows are de-duplicated on (gameid,
+    participantid), later files winning, and team names normalized across seasons with
+    team_name_map (`team_aliases` defaults to TEAM_ALIASES_PATH). The merged store is a Feather file under .cache/ next to the first
+    season, keyed by the seasons' contents and `team_aliases`, and memory-mapped like
+    read_data's cache, so `columns` and `compact` behave the same.
+    """
+    paths = expand_data_paths(paths)
+    team_aliases = load_team_aliases() if team_aliases is None else team_aliases
+    tables = [_season_parts(path) for path in paths]
+    metas = []
+    for path in paths:
+        with open(_parts_paths(path)[1], 'r') as f:
+            metas.append(json.load(f)['sha1'])
+    key = hashlib.sha1(json.dumps([SEASONS_VERSION, metas, sorted(team_aliases.items())]).encode()).hexdigest()[:16]
+    # One merged store per set of season files; a new version replaces the older ones
+    source = hashlib.sha1(json.dumps([os.path.abspath(path) for path in paths]).encode()).hexdigest()[:8]
+    cache_dir = _cache_paths(paths[0])[0]
+    merged_path = os.path.join(cache_dir, f"seasons-{source}-{key}.feather")
+    if not os.path.exists(merged_path):
+        logger.info(f"Merging {len(paths)} season files into {merged_path}")
+        _merge_seasons(tables, merged_path, team_aliases)
+        for name in os.listdir(cache_dir):
+            stale = name.startswith(f"seasons-{source}-") or name.count('-') == 1  # or named before the source prefix
+            if stale and name.startswith('seasons-') and name.endswith('.feather') and name != os.path.basename(merged_path):
+                # Processes that still have the old store mapped keep reading it
+                os.remove(os.path.join(cache_dir, name))
+    del tables
+    table = feather.read_table(merged_path, memory_map=True)
+    if columns:
+        table = table.select([c for c in table.column_names if c in columns])
+    df = table.to_pandas()
+    return compact_frame(df) if compact else df
+
+def read_shared(path, columns=None):
+    """read_data(path, columns, compact=True) through a frame shared by every local process.
+
+    The first caller loads and publishes it (see shared.py); later callers, in any
+    process, attach to it read-only without copying, so memory stays flat as dashboard
+    sessions, CLI runs and workers are added. It is republished when a data file, the
+    team aliases or the cache layout change.
+    """
+    paths = expand_data_paths(path)
+    source = {'paths': [os.path.abspath(p) for p in paths], 'seasons': _is_seasons(path), 'columns': sorted(columns) if columns else None}
+    version = {'files': data_version(paths), 'aliases': load_team_aliases(), 'layout': [CACHE_VERSION, SEASONS_VERSION]}
+    return shared.load(source, version, lambda: read_data(path, columns, compact=True))
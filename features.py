@@ -1,142 +1,97 @@
 import numpy as np
 import pandas as pd
 from datetime import datetime
+from functools import partial
+import re
+import time
+
+from history import HistoryIndex
+from recency import parse_window, recency_sums, window_token
+
+MIN_GAMES = 5
+
+STATS = [
+    'assists', 'assistsat10', 'assistsat15', 'assistsat20', 'assistsat25',
+    'barons', 'ckpm', 'csdiffat10', 'csdiffat15', 'csdiffat20', 'csdiffat25',
+    'cspm', 'damageshare', 'damagetakenperminute', 'damagetochampions',
+    'deaths', 'deathsat10', 'deathsat15', 'deathsat20', 'deathsat25', 'dpm',
+    'dragons', 'earned gpm', 'earnedgold', 'earnedgoldshare', 'firstblood',
+    'firstbloodassist', 'firstdragon', 'firstherald', 'firstmidtower',
+    'firsttothreetowers', 'firsttower', 'gamelength', 'goldat10', 'goldat15',
+    'goldat20', 'goldat25', 'golddiffat10', 'golddiffat15', 'golddiffat20',
+    'golddiffat25', 'gpr', 'gspd', 'heralds', 'inhibitors', 'kills',
+    'killsat10', 'killsat15', 'killsat20', 'killsat25', 'result', 'team kpm',
+    'teamdeaths', 'teamkills', 'totalgold', 'visionscore', 'vspm', 'xpat25',
+    'xpdiffat25',
+]
+
+# feature name -> (kind, raw stat column), e.g. 'feat_opp_earned_gpm' -> ('opp', 'earned gpm')
+FEATURE_SPECS = {f"feat_{stat.replace(' ', '_')}": ('player', stat) for stat in STATS}
+FEATURE_SPECS.update({f"feat_opp_{stat.replace(' ', '_')}": ('opp', stat) for stat in STATS})
+
+# Recency variants put a window token after the kind prefix, e.g. feat_ewm10g_kills
+# (half-life of 10 games), feat_opp_ewm30d_kills (30 days) or feat_last5_kills
+RECENCY_PATTERN = re.compile(r'^feat_(opp_)?((?:ewm\d+[gd])|(?:last\d+))_(.+)$')
+_STAT_NAMES = {stat.replace(' ', '_'): stat for stat in STATS}
+
+def feature_spec(name):
+    """(kind, stat, window) of a feature name, window being None for all-history means.
+
+    Covers FEATURE_SPECS and their recency.Window variants; raises KeyError otherwise.
+    """
+    if name in FEATURE_SPECS:
+        return FEATURE_SPECS[name] + (None,)
+    match = RECENCY_PATTERN.match(name)
+    if match is None or match.group(3) not in _STAT_NAMES:
+        raise KeyError(name)
+    return ('opp' if match.group(1) else 'player', _STAT_NAMES[match.group(3)], parse_window(match.group(2)))
+
+def feature_windows(features):
+    # Distinct recency windows used by a feature list, in order
+    return list(dict.fromkeys(w for w in (feature_spec(f)[2] for f in features) if w is not None))
 
 class NotEnoughDataException(Exception):
     pass
 
 class FeatureExtractor:
-    def __init__(self, df, game_desc, window_size=None, values_only=True):
+    def __init__(self, history, game_desc, window_size=None, values_only=True, metrics=None):
+        # Accepts a HistoryIndex; a raw DataFrame is indexed on the fly, which is slow in a loop.
+        # metrics: an optional metrics.ExtractionMetrics that timings and recency cache hits are added to
+        if not isinstance(history, HistoryIndex):
+            history = HistoryIndex(history)
+        self.history = history
         self.game_desc = game_desc
-        self.df_hist = df[df['date'] < game_desc.date]
         self.values_only = values_only
+        self.metrics = metrics
+        self._lookup_seconds = 0.0
+        self._player_rows = None
+        self._opponent_rows = None
+        kind2func = {
+            'player': self.average_hist_player,
+            'opp': self.average_hist_opponent_gives_up,
+        }
         self.name2func = {
-            'feat_assists': lambda: self.average_hist_player('assists'),
-            'feat_assistsat10': lambda: self.average_hist_player('assistsat10'),
-            'feat_assistsat15': lambda: self.average_hist_player('assistsat15'),
-            'feat_assistsat20': lambda: self.average_hist_player('assistsat20'),
-            'feat_assistsat25': lambda: self.average_hist_player('assistsat25'),
-            'feat_barons': lambda: self.average_hist_player('barons'),
-            'feat_ckpm': lambda: self.average_hist_player('ckpm'),
-            'feat_csdiffat10': lambda: self.average_hist_player('csdiffat10'),
-            'feat_csdiffat15': lambda: self.average_hist_player('csdiffat15'),
-            'feat_csdiffat20': lambda: self.average_hist_player('csdiffat20'),
-            'feat_csdiffat25': lambda: self.average_hist_player('csdiffat25'),
-            'feat_cspm': lambda: self.average_hist_player('cspm'),
-            'feat_damageshare': lambda: self.average_hist_player('damageshare'),
-            'feat_damagetakenperminute': lambda: self.average_hist_player('damagetakenperminute'),
-            'feat_damagetochampions': lambda: self.average_hist_player('damagetochampions'),
-            'feat_deaths': lambda: self.average_hist_player('deaths'),
-            'feat_deathsat10': lambda: self.average_hist_player('deathsat10'),
-            'feat_deathsat15': lambda: self.average_hist_player('deathsat15'),
-            'feat_deathsat20': lambda: self.average_hist_player('deathsat20'),
-            'feat_deathsat25': lambda: self.average_hist_player('deathsat25'),
-            'feat_dpm': lambda: self.average_hist_player('dpm'),
-            'feat_dragons': lambda: self.average_hist_player('dragons'),
-            'feat_earned_gpm': lambda: self.average_hist_player('earned gpm'),
-            'feat_earnedgold': lambda: self.average_hist_player('earnedgold'),
-            'feat_earnedgoldshare': lambda: self.average_hist_player('earnedgoldshare'),
-            'feat_firstblood': lambda: self.average_hist_player('firstblood'),
-            'feat_firstbloodassist': lambda: self.average_hist_player('firstbloodassist'),
-            'feat_firstdragon': lambda: self.average_hist_player('firstdragon'),
-            'feat_firstherald': lambda: self.average_hist_player('firstherald'),
-            'feat_firstmidtower': lambda: self.average_hist_player('firstmidtower'),
-            'feat_firsttothreetowers': lambda: self.average_hist_player('firsttothreetowers'),
-            'feat_firsttower': lambda: self.average_hist_player('firsttower'),
-            'feat_gamelength': lambda: self.average_hist_player('gamelength'),
-            'feat_goldat10': lambda: self.average_hist_player('goldat10'),
-            'feat_goldat15': lambda: self.average_hist_player('goldat15'),
-            'feat_goldat20': lambda: self.average_hist_player('goldat20'),
-            'feat_goldat25': lambda: self.average_hist_player('goldat25'),
-            'feat_golddiffat10': lambda: self.average_hist_player('golddiffat10'),
-            'feat_golddiffat15': lambda: self.average_hist_player('golddiffat15'),
-            'feat_golddiffat20': lambda: self.average_hist_player('golddiffat20'),
-            'feat_golddiffat25': lambda: self.average_hist_player('golddiffat25'),
-            'feat_gpr': lambda: self.average_hist_player('gpr'),
-            'feat_gspd': lambda: self.average_hist_player('gspd'),
-            'feat_heralds': lambda: self.average_hist_player('heralds'),
-            'feat_inhibitors': lambda: self.average_hist_player('inhibitors'),
-            'feat_kills': lambda: self.average_hist_player('kills'),
-            'feat_killsat10': lambda: self.average_hist_player('killsat10'),
-            'feat_killsat15': lambda: self.average_hist_player('killsat15'),
-            'feat_killsat20': lambda: self.average_hist_player('killsat20'),
-            'feat_killsat25': lambda: self.average_hist_player('killsat25'),
-            'feat_result': lambda: self.average_hist_player('result'),
-            'feat_team_kpm': lambda: self.average_hist_player('team kpm'),
-            'feat_teamdeaths': lambda: self.average_hist_player('teamdeaths'),
-            'feat_teamkills': lambda: self.average_hist_player('teamkills'),
-            'feat_totalgold': lambda: self.average_hist_player('totalgold'),
-            'feat_visionscore': lambda: self.average_hist_player('visionscore'),
-            'feat_vspm': lambda: self.average_hist_player('vspm'),
-            'feat_xpat25': lambda: self.average_hist_player('xpat25'),
-            'feat_xpdiffat25': lambda: self.average_hist_player('xpdiffat25'),
-            'feat_opp_assists': lambda: self.average_hist_opponent_gives_up('assists'),
-            'feat_opp_assistsat10': lambda: self.average_hist_opponent_gives_up('assistsat10'),
-            'feat_opp_assistsat15': lambda: self.average_hist_opponent_gives_up('assistsat15'),
-            'feat_opp_assistsat20': lambda: self.average_hist_opponent_gives_up('assistsat20'),
-            'feat_opp_assistsat25': lambda: self.average_hist_opponent_gives_up('assistsat25'),
-            'feat_opp_barons': lambda: self.average_hist_opponent_gives_up('barons'),
-            'feat_opp_ckpm': lambda: self.average_hist_opponent_gives_up('ckpm'),
-            'feat_opp_csdiffat10': lambda: self.average_hist_opponent_gives_up('csdiffat10'),
-            'feat_opp_csdiffat15': lambda: self.average_hist_opponent_gives_up('csdiffat15'),
-            'feat_opp_csdiffat20': lambda: self.average_hist_opponent_gives_up('csdiffat20'),
-            'feat_opp_csdiffat25': lambda: self.average_hist_opponent_gives_up('csdiffat25'),
-            'feat_opp_cspm': lambda: self.average_hist_opponent_gives_up('cspm'),
-            'feat_opp_damageshare': lambda: self.average_hist_opponent_gives_up('damageshare'),
-            'feat_opp_damagetakenperminute': lambda: self.average_hist_opponent_gives_up('damagetakenperminute'),
-            'feat_opp_damagetochampions': lambda: self.average_hist_opponent_gives_up('damagetochampions'),
-            'feat_opp_deaths': lambda: self.average_hist_opponent_gives_up('deaths'),
-            'feat_opp_deathsat10': lambda: self.average_hist_opponent_gives_up('deathsat10'),
-            'feat_opp_deathsat15': lambda: self.average_hist_opponent_gives_up('deathsat15'),
-            'feat_opp_deathsat20': lambda: self.average_hist_opponent_gives_up('deathsat20'),
-            'feat_opp_deathsat25': lambda: self.average_hist_opponent_gives_up('deathsat25'),
-            'feat_opp_dpm': lambda: self.average_hist_opponent_gives_up('dpm'),
-            'feat_opp_dragons': lambda: self.average_hist_opponent_gives_up('dragons'),
-            'feat_opp_earned_gpm': lambda: self.average_hist_opponent_gives_up('earned gpm'),
-            'feat_opp_earnedgold': lambda: self.average_hist_opponent_gives_up('earnedgold'),
-            'feat_opp_earnedgoldshare': lambda: self.average_hist_opponent_gives_up('earnedgoldshare'),
-            'feat_opp_firstblood': lambda: self.average_hist_opponent_gives_up('firstblood'),
-            'feat_opp_firstbloodassist': lambda: self.average_hist_opponent_gives_up('firstbloodassist'),
-            'feat_opp_firstdragon': lambda: self.average_hist_opponent_gives_up('firstdragon'),
-            'feat_opp_firstherald': lambda: self.average_hist_opponent_gives_up('firstherald'),
-            'feat_opp_firstmidtower': lambda: self.average_hist_opponent_gives_up('firstmidtower'),
-            'feat_opp_firsttothreetowers': lambda: self.average_hist_opponent_gives_up('firsttothreetowers'),
-            'feat_opp_firsttower': lambda: self.average_hist_opponent_gives_up('firsttower'),
-            'feat_opp_gamelength': lambda: self.average_hist_opponent_gives_up('gamelength'),
-            'feat_opp_goldat10': lambda: self.average_hist_opponent_gives_up('goldat10'),
-            'feat_opp_goldat15': lambda: self.average_hist_opponent_gives_up('goldat15'),
-            'feat_opp_goldat20': lambda: self.average_hist_opponent_gives_up('goldat20'),
-            'feat_opp_goldat25': lambda: self.average_hist_opponent_gives_up('goldat25'),
-            'feat_opp_golddiffat10': lambda: self.average_hist_opponent_gives_up('golddiffat10'),
-            'feat_opp_golddiffat15': lambda: self.average_hist_opponent_gives_up('golddiffat15'),
-            'feat_opp_golddiffat20': lambda: self.average_hist_opponent_gives_up('golddiffat20'),
-            'feat_opp_golddiffat25': lambda: self.average_hist_opponent_gives_up('golddiffat25'),
-            'feat_opp_gpr': lambda: self.average_hist_opponent_gives_up('gpr'),
-            'feat_opp_gspd': lambda: self.average_hist_opponent_gives_up('gspd'),
-            'feat_opp_heralds': lambda: self.average_hist_opponent_gives_up('heralds'),
-            'feat_opp_inhibitors': lambda: self.average_hist_opponent_gives_up('inhibitors'),
-            'feat_opp_kills': lambda: self.average_hist_opponent_gives_up('kills'),
-            'feat_opp_killsat10': lambda: self.average_hist_opponent_gives_up('killsat10'),
-            'feat_opp_killsat15': lambda: self.average_hist_opponent_gives_up('killsat15'),
-            'feat_opp_killsat20': lambda: self.average_hist_opponent_gives_up('killsat20'),
-            'feat_opp_killsat25': lambda: self.average_hist_opponent_gives_up('killsat25'),
-            'feat_opp_result': lambda: self.average_hist_opponent_gives_up('result'),
-            'feat_opp_team_kpm': lambda: self.average_hist_opponent_gives_up('team kpm'),
-            'feat_opp_teamdeaths': lambda: self.average_hist_opponent_gives_up('teamdeaths'),
-            'feat_opp_teamkills': lambda: self.average_hist_opponent_gives_up('teamkills'),
-            'feat_opp_totalgold': lambda: self.average_hist_opponent_gives_up('totalgold'),
-            'feat_opp_visionscore': lambda: self.average_hist_opponent_gives_up('visionscore'),
-            'feat_opp_vspm': lambda: self.average_hist_opponent_gives_up('vspm'),
-            'feat_opp_xpat25': lambda: self.average_hist_opponent_gives_up('xpat25'),
-            'feat_opp_xpdiffat25': lambda: self.average_hist_opponent_gives_up('xpdiffat25'),
+            name: partial(kind2func[kind], stat)
+            for name, (kind, stat) in FEATURE_SPECS.items()
         }
         self.computed_cache = {}
 
+    def _func(self, feature_name):
+        if feature_name not in self.name2func:
+            kind, stat, window = feature_spec(feature_name)
+            self.name2func[feature_name] = partial(self.recency_predictor, kind, stat, window)
+        return self.name2func[feature_name]
+
     def extract(self, feature_name):
         if feature_name in self.computed_cache:
             value = self.computed_cache[feature_name]
+        elif self.metrics is not None:
+            start, lookup_start = time.perf_counter(), self._lookup_seconds
+            value = self._func(feature_name)()
+            # History lookups inside the call are charged to 'lookup:<kind>' instead
+            self.metrics.time_feature(feature_name, time.perf_counter() - start - (self._lookup_seconds - lookup_start))
         else:
-            value = self.name2func[feature_name]()
+            value = self._func(feature_name)()
         if isinstance(value, np.float64):
             value = float(value)
         self.computed_cache[feature_name] = value
@@ -146,22 +101,330 @@ class FeatureExtractor:
 
     def average_hist_player(self, feature_name):
         # OFFENSE How we do against other people
-        player_games = self.df_hist[self.df_hist['playername'] == self.game_desc.playername]
-        if len(player_games) < 5:
-            raise NotEnoughDataException()
-        return player_games[feature_name].dropna().mean()
+        if self._player_rows is None:
+            self._player_rows = self._timed_lookup('player', self.history.player_rows, self.game_desc.playername, self.game_desc.date)
+        if len(self._player_rows) < MIN_GAMES:
+            raise NotEnoughDataException('not enough player history')
+        return self.history.mean(feature_name, self._player_rows)
 
     def average_hist_opponent_gives_up(self, feature_name):
         # DEFENSE Things which other people do on this opponent (how good can this oppoent defend)
-        opp_team_games = self.df_hist[self.df_hist['teamname'] == self.game_desc.opp_teamname]
-        game_ids = opp_team_games['gameid'].unique()
-        all_games = self.df_hist[self.df_hist['gameid'].isin(game_ids)]
-        all_games_fltr = all_games[all_games['teamname'] != self.game_desc.opp_teamname]
-        all_games_fltr_pos = all_games_fltr[all_games_fltr['position'] == self.game_desc.position]
-        if len(all_games_fltr_pos) < 5:
-            raise NotEnoughDataException()
-        return all_games_fltr_pos[feature_name].dropna().mean()
+        if self._opponent_rows is None:
+            self._opponent_rows = self._timed_lookup(
+                'opp', self.history.opponent_rows, self.game_desc.opp_teamname, self.game_desc.position, self.game_desc.date)
+        if len(self._opponent_rows) < MIN_GAMES:
+            raise NotEnoughDataException('not enough opponent history')
+        return self.history.mean(feature_name, self._opponent_rows)
     
-    def recency_predictor(self, feature_name):
-        # TODO: what goes here (same patch? past N patches? games?)
-        pass
\ No newline at end of file
+    def _timed_lookup(self, kind, lookup, *key):
+        if self.metrics is None:
+            return lookup(*key)
+        start = time.perf_counter()
+        rows = lookup(*key)
+        elapsed = time.perf_counter() - start
+        self._lookup_seconds += elapsed
+        self.metrics.time_feature(f'lookup:{kind}', elapsed)
+        return rows
+
+    def recency_predictor(self, kind, stat, window):
+        # Recency-weighted player / opponent-gives-up mean, read from per-key decayed sums
+        if kind == 'player':
+            key = (self.game_desc.playername,)
+        else:
+            key = (self.game_desc.opp_teamname, self.game_desc.position)
+        misses = self.history.recency_misses
+        value, prior_rows = self.history.recency_mean(kind, key, stat, window, self.game_desc.date)
+        if self.metrics is not None:
+            # The extractor lives for one row; the HistoryIndex cache is what rows share
+            if self.history.recency_misses > misses:
+                self.metrics.cache_misses += 1
+            else:
+                self.metrics.cache_hits += 1
+        if prior_rows < MIN_GAMES:
+            raise NotEnoughDataException('not enough player history' if kind == 'player' else 'not enough opponent history')
+        return value
+
+def extract_batch(history, games, features):
+    """Feature matrix for a list of data.Input games against a HistoryIndex.
+
+    Each distinct (player, date) and (opponent, position, date) is looked up once and
+    all its stats averaged together. Returns the matrix and a dict of row index to skip
+    reason for games that would raise NotEnoughDataException; their rows are NaN.
+    """
+    X = np.full((len(games), len(features)), np.nan)
+    skipped = {}
+    sides = {
+        'player': (lambda g: (g.playername, g.date), history.player_rows, 'not enough player history'),
+        'opp': (lambda g: (g.opp_teamname, g.position, g.date), history.opponent_rows, 'not enough opponent history'),
+    }
+    specs = [feature_spec(name) for name in features]
+    for kind, (key_of, lookup, reason) in sides.items():
+        cols = [j for j, (k, _, window) in enumerate(specs) if k == kind and window is None]
+        if not cols:
+            continue
+        stats = [specs[j][1] for j in cols]
+        cache = {}
+        for i, game in enumerate(games):
+            key = key_of(game)
+            if key not in cache:
+                rows = lookup(*key)
+                cache[key] = history.means(stats, rows) if len(rows) >= MIN_GAMES else None
+            if cache[key] is None:
+                skipped.setdefault(i, reason)
+            else:
+                X[i, cols] = cache[key]
+    for j, (kind, stat, window) in enumerate(specs):
+        if window is None:
+            continue
+        for i, game in enumerate(games):
+            key = (game.playername,) if kind == 'player' else (game.opp_teamname, game.position)
+            X[i, j], prior_rows = history.recency_mean(kind, key, stat, window, game.date)
+            if prior_rows < MIN_GAMES:
+                skipped.setdefault(i, sides[kind][2])
+    X[list(skipped)] = np.nan
+    return X, skipped
+
+def _opponents(df):
+    # Other team in each row's game, NaN unless the game has exactly two teams
+    teams = df[['gameid', 'teamname']].drop_duplicates().groupby('gameid', sort=False, observed=True)['teamname']
+    first, last = df['gameid'].map(teams.first()), df['gameid'].map(teams.last())
+    opp = first.where(df['teamname'] != first, last)
+    return opp.where(df['gameid'].map(teams.count()) == 2)
+
+def _prior_aggregates(keys, dates, values):
+    """Point-in-time aggregates over rows sharing a key with a strictly earlier date.
+
+    Returns (rows, counts, sums) aligned with the input: the number of prior rows, and
+    per column the number and sum of prior non-NaN values. Rows with a missing key get
+    aggregates over the other missing-key rows and should be masked by the caller.
+    """
+    codes = _key_codes(keys)
+    dates = dates.to_numpy(dtype='datetime64[ns]').view(np.int64)
+    order = np.lexsort((dates, codes))
+    codes, dates = codes[order], dates[order]
+    vals = values.to_numpy(dtype=np.float64)[order]
+    present = ~np.isnan(vals)
+    vals = np.where(present, vals, 0.0)
+
+    grouped = pd.DataFrame(np.hstack([present, vals])).groupby(codes, sort=False)
+    cum = grouped.cumsum().to_numpy() - np.hstack([present, vals])
+    rows = grouped.cumcount().to_numpy()
+
+    # Rows of the same key on the same date must not see each other
+    new_run = np.ones(len(codes), dtype=bool)
+    new_run[1:] = (codes[1:] != codes[:-1]) | (dates[1:] != dates[:-1])
+    run_start = np.maximum.accumulate(np.where(new_run, np.arange(len(codes)), 0))
+    cum, rows = cum[run_start], rows[run_start]
+
+    inverse = np.empty_like(order)
+    inverse[order] = np.arange(len(order))
+    n = vals.shape[1]
+    return rows[inverse], cum[inverse, :n], cum[inverse, n:]
+
+def _feature_keys(df):
+    opp = _opponents(df)
+    return opp, {'player': [df['playername']], 'opp': [opp, df['position']]}
+
+def feature_keys(df):
+    # kind -> MultiIndex of each row's key: (playername,) or (opponent, position)
+    return {kind: _key_index(kind_keys) for kind, kind_keys in _feature_keys(df)[1].items()}
+
+def _key_index(keys):
+    return pd.MultiIndex.from_arrays([k.to_numpy(dtype=object) for k in keys])
+
+def _key_codes(keys):
+    # Dense code per distinct key, -1 where any part of the key is missing
+    codes = keys[0].groupby(keys, sort=False, observed=True).ngroup()
+    return codes.fillna(-1).to_numpy(dtype=np.int64)
+
+def _recency_columns(window, stats):
+    # State columns a recency window keeps per key, see recency_state
+    token = window_token(window)
+    if window.mode == 'last':
+        return [f'{token}:games'] + [f'{token}:{i}_{s}' for i in range(window.n) for s in stats]
+    return ([f'{token}:sum_{s}' for s in stats] + [f'{token}:weight_{s}' for s in stats]
+            + ([f'{token}:last_date'] if window.mode == 'days' else []))
+
+def _recency_scan(keys, dates, values, window, base=None):
+    """Run recency.recency_sums over the rows of `values` grouped by key, after `base`.
+
+    `base` holds per-key recency_state columns of earlier history; they enter the scan
+    as pseudo-rows ahead of each key's rows. Returns the scan in (key, pseudo-rows
+    first, date) order as a dict of arrays, with 'row' the position in `values` of each
+    real row and -1 for pseudo-rows.
+    """
+    codes = _key_codes(keys)
+    stats = list(values.columns)
+    vals = values.to_numpy(dtype=np.float64)
+    present = ~np.isnan(vals)
+    parts = [(codes, dates.to_numpy(dtype='datetime64[ns]').view(np.int64), np.where(present, vals, 0.0),
+              present.astype(np.float64), np.arange(len(codes)))]
+    if base is not None and len(codes):
+        uniq, first = np.unique(codes, return_index=True)
+        first = first[uniq >= 0]
+        index = _key_index([k.iloc[first] for k in keys])
+        known = index.isin(base.index)
+        prior = base.reindex(index[known])
+        code_of = codes[first][known]
+        token = window_token(window)
+        if window.mode == 'last':
+            filled = prior[f'{token}:games'].to_numpy(dtype=np.int64)
+            for slot in range(window.n):
+                # Buffers are right-aligned: slot n - 1 is the latest game
+                has = slot >= window.n - filled
+                slot_vals = prior[[f'{token}:{slot}_{s}' for s in stats]].to_numpy(dtype=np.float64)[has]
+                slot_present = ~np.isnan(slot_vals)
+                parts.insert(-1, (code_of[has], np.zeros(int(has.sum()), dtype=np.int64), np.where(slot_present, slot_vals, 0.0),
+                                  slot_present.astype(np.float64), np.full(int(has.sum()), -1)))
+        else:
+            last = (prior[f'{token}:last_date'].to_numpy(dtype='datetime64[ns]').view(np.int64) if window.mode == 'days'
+                    else np.zeros(len(prior), dtype=np.int64))
+            parts.insert(0, (code_of, last, prior[[f'{token}:sum_{s}' for s in stats]].to_numpy(dtype=np.float64),
+                             prior[[f'{token}:weight_{s}' for s in stats]].to_numpy(dtype=np.float64), np.full(len(prior), -1)))
+    codes, dates, x, p, row = (np.concatenate(arrays) for arrays in zip(*parts))
+    # lexsort is stable, so pseudo-rows keep their buffer order ahead of the key's rows
+    order = np.lexsort((dates, row >= 0, codes))
+    codes, dates, x, p, row = codes[order], dates[order], x[order], p[order], row[order]
+    starts = np.ones(len(codes), dtype=bool)
+    starts[1:] = codes[1:] != codes[:-1]
+    sums, weights = recency_sums(starts, dates.view('datetime64[ns]'), x, p, window)
+    return {'codes': codes, 'dates': dates, 'x': x, 'p': p, 'row': row, 'starts': starts, 'sums': sums, 'weights': weights}
+
+def _prior_recency(keys, dates, values, window, base=None):
+    # Recency-weighted (sums, weights) over each row's key strictly before its date
+    scan = _recency_scan(keys, dates, values, window, base)
+    codes, row, starts = scan['codes'], scan['row'], scan['starts']
+    n = len(codes)
+    new_run = starts | (row < 0)
+    new_run[1:] |= (scan['dates'][1:] != scan['dates'][:-1]) | (row[:-1] < 0)
+    pos = np.arange(n)
+    run_start = np.maximum.accumulate(np.where(new_run, pos, 0))
+    key_start = np.maximum.accumulate(np.where(starts, pos, 0))
+    prior = run_start - 1
+    has_prior = (prior >= key_start)[:, None]
+    prior = np.maximum(prior, 0)
+    sums = np.where(has_prior, scan['sums'][prior], 0.0)
+    weights = np.where(has_prior, scan['weights'][prior], 0.0)
+    real = row >= 0
+    out_sums, out_weights = np.empty((len(values), sums.shape[1])), np.empty((len(values), sums.shape[1]))
+    out_sums[row[real]], out_weights[row[real]] = sums[real], weights[real]
+    return out_sums, out_weights
+
+def recency_state(keys, values, dates, window, base=None):
+    """Per-key recency state after the rows of `values`, continuing `base`.
+
+    EWM windows keep the decayed sum and weight of every column (and the date they
+    were last decayed to, for half-lives in days); 'last' windows keep the key's last n
+    games, latest in the highest slot. Keys missing from `values` are not returned.
+    """
+    scan = _recency_scan(keys, dates, values, window, base)
+    codes, starts = scan['codes'], scan['starts']
+    stats = list(values.columns)
+    token = window_token(window)
+    ends = np.flatnonzero(np.r_[starts[1:], True])
+    ends = ends[codes[ends] >= 0]
+    code_rows = {code: i for i, code in enumerate(_key_codes(keys))}
+    index = _key_index([k.iloc[[code_rows[c] for c in codes[ends]]] for k in keys]) if len(ends) else _key_index([k.iloc[:0] for k in keys])
+    columns = {}
+    if window.mode == 'last':
+        key_start = np.maximum.accumulate(np.where(starts, np.arange(len(codes)), 0))[ends]
+        columns[f'{token}:games'] = np.minimum(ends - key_start + 1, window.n)
+        for slot in range(window.n):
+            at = ends - (window.n - 1 - slot)
+            has = at >= key_start
+            at = np.maximum(at, 0)
+            slot_vals = np.where(scan['p'][at] > 0, scan['x'][at], np.nan)
+            for j, s in enumerate(stats):
+                columns[f'{token}:{slot}_{s}'] = np.where(has, slot_vals[:, j], np.nan)
+    else:
+        for j, s in enumerate(stats):
+            columns[f'{token}:sum_{s}'] = scan['sums'][ends, j]
+        for j, s in enumerate(stats):
+            columns[f'{token}:weight_{s}'] = scan['weights'][ends, j]
+        if window.mode == 'days':
+            columns[f'{token}:last_date'] = scan['dates'][ends].view('datetime64[ns]')
+    return pd.DataFrame(columns, index=index)
+
+def aggregate_state(keys, values):
+    # Per-key totals of rows and non-NaN counts/sums of each column of `values`
+    present = values.notna()
+    frame = pd.concat([
+        pd.Series(1, index=values.index, name='rows'),
+        present.astype(np.int64).add_prefix('count_'),
+        values.astype(np.float64).where(present, 0.0).add_prefix('sum_'),
+    ], axis=1)
+    frame.index = _key_index(keys)
+    totals = frame[frame.index.to_frame().notna().all(axis=1).to_numpy()].groupby(level=list(range(len(keys)))).sum()
+    if not isinstance(totals.index, pd.MultiIndex):
+        totals.index = pd.MultiIndex.from_arrays([totals.index])
+    return totals
+
+def state_stats(frame):
+    # STATS a feature_state frame keeps totals for
+    return [s for s in STATS if f'count_{s}' in frame.columns]
+
+def feature_state(df, windows=(), base=None):
+    """Running totals per kind after all of `df`, in the form compute_feature_frame takes as `base`.
+
+    Continues a previous feature_state `base` if given. Totals add up; the recency
+    state of `windows` is carried forward from `base` for keys `df` does not touch.
+    Only the STATS columns `df` has are kept, e.g. for a frame projected with
+    data.columns_for_features, and `base` must have been built from the same ones.
+    """
+    _, keys = _feature_keys(df)
+    stats = [s for s in STATS if s in df.columns]
+    state = {}
+    for kind, kind_keys in keys.items():
+        totals = aggregate_state(kind_keys, df[stats])
+        if base is not None:
+            if state_stats(base[kind]) != stats:
+                raise ValueError(f"Base state keeps stats {state_stats(base[kind])}, the data has {stats}")
+            plain = [c for c in base[kind].columns if ':' not in c]
+            totals = base[kind][plain].add(totals, fill_value=0)
+        parts = [totals]
+        for window in windows:
+            prior = base[kind] if base is not None else None
+            recent = recency_state(kind_keys, df[stats], df['date'], window, prior)
+            if prior is not None:
+                kept = prior.loc[~prior.index.isin(recent.index), _recency_columns(window, stats)]
+                recent = pd.concat([kept, recent])
+            parts.append(recent)
+        state[kind] = pd.concat(parts, axis=1)
+    return state
+
+def compute_feature_frame(df, features, base=None):
+    """Compute `features` for every row of `df` at once.
+
+    Gives the values FeatureExtractor.extract would for each row, using only history
+    strictly before the row's date. Also returns a boolean mask that is False where the
+    per-row extractor would fail, i.e. fewer than MIN_GAMES history rows or no opponent.
+
+    `base` optionally holds per-kind feature_state totals of earlier history that is
+    not in `df`; it is added to every row's aggregates.
+    """
+    opp, keys = _feature_keys(df)
+    valid = opp.notna().to_numpy()
+    specs = {name: feature_spec(name) for name in features}
+    columns = {}
+    for kind, kind_keys in keys.items():
+        names = [name for name in features if specs[name][0] == kind]
+        if not names:
+            continue
+        stats = list(dict.fromkeys(specs[name][1] for name in names))
+        rows, counts, sums = _prior_aggregates(kind_keys, df['date'], df[stats])
+        if base is not None:
+            prior = base[kind].reindex(_key_index(kind_keys)).fillna(0)
+            rows = rows + prior['rows'].to_numpy()
+            counts = counts + prior[[f'count_{s}' for s in stats]].to_numpy()
+            sums = sums + prior[[f'sum_{s}' for s in stats]].to_numpy()
+        valid &= rows >= MIN_GAMES
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = {None: sums / counts}
+            for window in feature_windows(names):
+                if base is not None and _recency_columns(window, stats)[0] not in base[kind].columns:
+                    raise ValueError(f"Base state has no {window_token(window)} recency state")
+                recent_sums, weights = _prior_recency(kind_keys, df['date'], df[stats], window, base[kind] if base is not None else None)
+                means[window] = recent_sums / weights
+        for name in names:
+            columns[name] = means[specs[name][2]][:, stats.index(specs[name][1])]
+    return pd.DataFrame(columns, index=df.index)[features], valid
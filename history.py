@@ -0,0 +1,120 @@
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from recency import recency_sums
+
+# Feature keys (a player, or an opponent team and position) whose recency sums are kept;
+# least recently used keys are dropped past this, so long-lived indexes stay bounded
+RECENCY_CACHE_KEYS = 16384
+
+def as_datetime64(date):
+    return np.datetime64(pd.Timestamp(date), 'ns')
+
+class HistoryIndex:
+    """Date-sorted match history with per-player, per-team and per-gameid row offsets.
+
+    Built once from data.read_data output; lookups return row offsets into `self.df`
+    for rows strictly before a date using a binary search over each key's dates.
+    """
+    def __init__(self, df, recency_cache_keys=RECENCY_CACHE_KEYS):
+        if df['date'].is_monotonic_increasing and df.index.equals(pd.RangeIndex(len(df))):
+            # Already in order, e.g. attached from shared memory; keep it rather than copying
+            self.df = df
+        else:
+            self.df = df.sort_values(by='date', kind='stable').reset_index(drop=True)
+        self.dates = self.df['date'].to_numpy(dtype='datetime64[ns]')
+        self.by_player = self._offsets('playername')
+        self.by_team = self._offsets('teamname')
+        self.by_gameid = self._offsets('gameid')
+        self._columns = {}
+        self._recency = OrderedDict()
+        self.recency_cache_keys = recency_cache_keys
+        # Lookups that found / had to compute the key's decayed sums
+        self.recency_hits = 0
+        self.recency_misses = 0
+
+    def _offsets(self, column):
+        return {
+            key: (offsets, self.dates[offsets])
+            for key, offsets in self.df.groupby(column, sort=False, observed=True).indices.items()
+        }
+
+    def _before(self, index, key, date):
+        if key not in index:
+            return np.empty(0, dtype=np.int64)
+        offsets, dates = index[key]
+        return offsets[:np.searchsorted(dates, as_datetime64(date), side='left')]
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = self.df[name].to_numpy()
+        return self._columns[name]
+
+    def player_rows(self, playername, date):
+        return self._before(self.by_player, playername, date)
+
+    def team_rows(self, teamname, date):
+        return self._before(self.by_team, teamname, date)
+
+    def game_rows(self, gameid):
+        return self.by_gameid[gameid][0]
+
+    def opponent_rows(self, opp_teamname, position, date):
+        # Rows of the other side, at `position`, in games `opp_teamname` played before `date`
+        game_ids = pd.unique(self.column('gameid')[self.team_rows(opp_teamname, date)])
+        if len(game_ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        offsets = np.sort(np.concatenate([self.game_rows(g) for g in game_ids]))
+        keep = (self.column('teamname')[offsets] != opp_teamname) & (self.column('position')[offsets] == position)
+        return offsets[keep]
+
+    def means(self, names, offsets):
+        # Column-wise mean of non-NaN values, NaN where a column has none
+        values = np.column_stack([self.column(name)[offsets] for name in names]).astype(np.float64)
+        present = ~np.isnan(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(present, values, 0.0).sum(axis=0) / present.sum(axis=0)
+
+    def mean(self, name, offsets):
+        values = self.column(name)[offsets].astype(np.float64)
+        values = values[~np.isnan(values)]
+        return values.mean() if len(values) else np.float64(np.nan)
+
+    def _key_rows(self, kind, key):
+        # All rows of a feature key: a player's rows, or the rows facing (team, position)
+        if kind == 'player':
+            return self.by_player[key[0]][0] if key[0] in self.by_player else np.empty(0, dtype=np.int64)
+        return self.opponent_rows(key[0], key[1], pd.Timestamp.max)
+
+    def recency_mean(self, kind, key, name, window, date):
+        """Recency-weighted mean of column `name` over the key's rows before `date`.
+
+        The key's decayed sums are computed once for all of its rows and cached, so each
+        lookup is a binary search; the cache holds the recency_cache_keys most recently
+        used keys. Returns (mean, number of rows before date).
+        """
+        entries = self._recency.get((kind, key))
+        if entries is None:
+            entries = self._recency[(kind, key)] = {}
+            if len(self._recency) > self.recency_cache_keys:
+                self._recency.popitem(last=False)
+        else:
+            self._recency.move_to_end((kind, key))
+        if (name, window) in entries:
+            self.recency_hits += 1
+        else:
+            self.recency_misses += 1
+            offsets = self._key_rows(kind, key)
+            values = self.column(name)[offsets].astype(np.float64)[:, None]
+            present = ~np.isnan(values)
+            starts = np.zeros(len(offsets), dtype=bool)
+            starts[:1] = True
+            sums, weights = recency_sums(starts, self.dates[offsets], np.where(present, values, 0.0), present, window)
+            entries[(name, window)] = (self.dates[offsets], sums[:, 0], weights[:, 0])
+        dates, sums, weights = entries[(name, window)]
+        prior = np.searchsorted(dates, as_datetime64(date), side='left')
+        if prior == 0 or weights[prior - 1] <= 0:
+            return np.float64(np.nan), prior
+        return sums[prior - 1] / weights[prior - 1], prior
@@ -2,53 +2,83 @@ import streamlit as st
 import numpy as np
 import altair as alt
 import pandas as pd
-from scipy.stats import poisson
+import os
+import threading
 from datetime import datetime
 import data
 import models
-from features import FeatureExtractor
+import pricing
+from features import FeatureExtractor, feature_windows
+from history import HistoryIndex
+from store import FeatureStore
 
 st.set_page_config(page_title="Poisson Distribution CDF", layout="centered")
 
-DATA_PATH = './data/2024_LoL_esports_match_data_from_OraclesElixir.csv'
-FEATURES_PATH = './checkpoints/checkpoint_20240901_234012/features.csv'
+DATA_PATH = './data/*_LoL_esports_match_data_from_OraclesElixir.csv'
+FEATURES_PATH = './master_features'
+MODEL_PATH = './artifacts/poisson.npz'
 FEATURES = data.get_features()
 
-# Placeholder function to load data
-@st.cache_data
-def load_data():
-    df = data.read_data(DATA_PATH)
-    if not FEATURES_PATH:
-        # logger.info(f'Extracting features: {FEATURES}')
-        X, Y = data.compute_features(df, datetime(2024, 7, 10), datetime.now(), FEATURES, 'kills', './features.csv')
-    else:
-        # logger.info(f'Loading precomputed features: {FEATURES}')
-        X, Y = data.load_dataset(FEATURES_PATH, FEATURES)
-    return df, X, Y
+# Attached read-only from shared memory, so sessions (and other local processes) share one
+# copy; cache_resource hands every session the same frame instead of pickling it per session.
+# Keyed on data.data_version so a new data drop is read instead of the cached frame
+@st.cache_resource(max_entries=1)
+def load_data(data_version):
+    return data.read_shared(DATA_PATH, columns=data.columns_for_features(FEATURES, []))
+
+# Built once per data version; the leading underscore stops streamlit hashing the frame.
+# Only needed for games dated before the snapshot's high-water mark.
+@st.cache_resource(max_entries=1)
+def load_history(data_version, _df):
+    return HistoryIndex(_df)
 
-# Placeholder function to train a model
+# As-of-now per-player and per-(opponent, position) totals, shared by all sessions
+@st.cache_resource
+def load_snapshot():
+    return {'store': FeatureStore(windows=feature_windows(FEATURES)), 'data_version': None, 'lock': threading.Lock()}
+
+def current_snapshot(df, data_version):
+    # Ingests only the games not seen yet, and only when the data files have changed
+    snapshot = load_snapshot()
+    with snapshot['lock']:
+        if snapshot['data_version'] != data_version:
+            snapshot['store'].ingest(df, features=[])
+            snapshot['players'] = snapshot['store'].players()
+            snapshot['teams'] = snapshot['store'].teams()
+            snapshot['data_version'] = data_version
+    return snapshot
+
+# Loads the artifact written by `main.py train`, falling back to fitting on FEATURES_PATH
 @st.cache_resource
-def train_model(X, Y):
+def train_model():
+    if os.path.exists(MODEL_PATH):
+        return models.load_model(MODEL_PATH, FEATURES)
     # logger.info('Running Montecarlo simulations to fit model...')
+    X, Y = data.load_dataset(FEATURES_PATH, FEATURES)
     model = models.PoissonRegression(X, Y)
     return model
 
 # Function to perform inference using the trained model
-def inference(df, game):
-    # Replace this logic with your actual inference logic
-    fe = FeatureExtractor(df, game)
-    input_nparr = np.array([[fe.extract(f) for f in FEATURES]])
+def inference(store, game):
+    # Upcoming games are a lookup into the snapshot; backdated ones need the point-in-time history
+    if store.high_water_mark is not None and game.date > store.high_water_mark:
+        input_nparr = np.array([store.latest(game, FEATURES)])
+    else:
+        fe = FeatureExtractor(load_history(data_version, df), game)
+        input_nparr = np.array([[fe.extract(f) for f in FEATURES]])
     lam = model.predict(input_nparr)[0]
     lam = round(lam, 2)
     return lam
 
 # Load data and train model once, when the app starts
-df, X, Y = load_data()
-model = train_model(X, Y)
+data_version = data.data_version(DATA_PATH)
+df = load_data(data_version)
+snapshot = current_snapshot(df, data_version)
+model = train_model()
 
 st.title('LoL Modeling')
-_players = list(df['playername'].unique())
-_teams = list(df['teamname'].unique())
+_players = snapshot['players']
+_teams = snapshot['teams']
 # User input fields
 date = st.date_input('Game Date')
 time = st.time_input('Game Time')
@@ -74,18 +104,13 @@ if st.button('Enter'):
         opp_teamname=opponent,
         position=position
     )
-    st.session_state.lambda_poisson = inference(df, game)*num_games
+    st.session_state.lambda_poisson = inference(snapshot['store'], game)*num_games
 
 # User input for x after lambda is calculated
 
 lambda_poisson = st.session_state.lambda_poisson
-# Calculate CDF
-under_val = x_val - 0.5
-over_val = x_val + 0.5
-
-under_prob = poisson.cdf(under_val, lambda_poisson) if under_val >= 0 else 0
-push_prob = poisson.pmf(x_val, lambda_poisson)
-over_prob = 1 - poisson.cdf(over_val, lambda_poisson)
+# Price the line and the chart's support in one pass each
+over_prob, under_prob, push_prob = (p[0] for p in pricing.poisson_prices([lambda_poisson], [x_val]))
 
 # Display the calculated lambda and CDF value
 st.markdown(f"""
@@ -98,19 +123,16 @@ st.markdown(f"""
 
 # Prepare data for Altair plot
 x = np.arange(0, 20)
-pmf = poisson.pmf(x, lambda_poisson)
+pmf = pricing.poisson_pmf(x, lambda_poisson)
 data = pd.DataFrame({'X': x, 'PMF': pmf})
 
 # Highlight areas
-under_df = pd.DataFrame({'X': np.arange(0, int(np.floor(under_val) + 1)), 'PMF': poisson.pmf(np.arange(0, int(np.floor(under_val) + 1)), lambda_poisson)})
-push_df = pd.DataFrame({'X': np.arange(int(np.floor(under_val) + 1), int(np.ceil(over_val))), 'PMF': poisson.pmf(np.arange(int(np.floor(under_val) + 1), int(np.ceil(over_val))), lambda_poisson)})
-over_df = pd.DataFrame({'X': np.arange(int(np.ceil(over_val)), 20), 'PMF': poisson.pmf(np.arange(int(np.ceil(over_val)), 20), lambda_poisson)})
+under_df = data[data['X'] < x_val]
+over_df = data[data['X'] > x_val]
 
 # Add interpolated points for push highlight
-push_interpolated = pd.DataFrame({
-    'X': np.concatenate([np.arange(x_val - 0.5, x_val + 0.5, 0.01), [x_val]]),
-    'PMF': np.concatenate([poisson.pmf(np.arange(x_val - 0.5, x_val + 0.5, 0.01), lambda_poisson), [push_prob]])
-})
+push_x = np.concatenate([np.arange(x_val - 0.5, x_val + 0.5, 0.01), [x_val]])
+push_interpolated = pd.DataFrame({'X': push_x, 'PMF': pricing.poisson_pmf(push_x, lambda_poisson)})
 
 # Base plot
 base = alt.Chart(data).mark_line(point=True).encode(
@@ -128,7 +150,7 @@ push_highlight = alt.Chart(push_interpolated).mark_area(opacity=0.3, color='gray
 over_highlight = alt.Chart(over_df).mark_area(opacity=0.3, color='green').encode(x='X:Q', y='PMF:Q')
 
 # Vertical line
-vertical_line = alt.Chart(pd.DataFrame({'X': [x_val], 'PMF': [0], 'PMF_end': [poisson.pmf(int(np.floor(x_val)), lambda_poisson) + (x_val - np.floor(x_val)) * (poisson.pmf(int(np.ceil(x_val)), lambda_poisson) - poisson.pmf(int(np.floor(x_val)), lambda_poisson))]})).mark_rule(color='red', strokeDash=[5, 5]).encode(x='X:Q', y='PMF:Q', y2='PMF_end:Q')
+vertical_line = alt.Chart(pd.DataFrame({'X': [x_val], 'PMF': [0], 'PMF_end': [np.interp(x_val, x, pmf)]})).mark_rule(color='red', strokeDash=[5, 5]).encode(x='X:Q', y='PMF:Q', y2='PMF_end:Q')
 
 # Combine plots
 final_chart = base + under_highlight + push_highlight + over_highlight + vertical_line
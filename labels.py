@@ -1,15 +1,68 @@
+# Raw columns each label reads, used to project the match data on load
+LABEL_COLUMNS = {
+    'kills': ['kills'],
+    'winlose': ['result'],
+    'assists': ['assists'],
+    'deaths': ['deaths'],
+    'cs': ['total cs'],
+    'visionscore': ['visionscore'],
+    'damage': ['damagetochampions'],
+}
+
+def label_names(label):
+    # 'kills', 'kills,assists' or a list of names -> list of names
+    names = label.split(',') if isinstance(label, str) else list(label)
+    names = [name.strip() for name in names if name.strip()]
+    unknown = [name for name in names if name not in LABEL_COLUMNS]
+    if unknown or not names:
+        raise ValueError(f"Unknown labels {unknown}, expected some of {list(LABEL_COLUMNS)}")
+    return names
+
+def label_column(name):
+    # Column a label is written to; 'label' itself always holds the first label
+    return f'label_{name}'
+
+def label_columns(label):
+    return ['label'] + [label_column(name) for name in label_names(label)]
+
 class LabelExtractor:
     def __init__(self):
         self.name2func = {
             'kills': self.kills,
             'winlose': self.winlose,
+            'assists': self.assists,
+            'deaths': self.deaths,
+            'cs': self.cs,
+            'visionscore': self.visionscore,
+            'damage': self.damage,
         }
-    
+
     def extract(self, df_row, label_name):
         return self.name2func[label_name](df_row)
-    
+
+    def extract_all(self, df_row, label):
+        # Every label_columns(label) column for a row or a whole frame
+        names = label_names(label)
+        values = {label_column(name): self.extract(df_row, name) for name in names}
+        return {'label': values[label_column(names[0])], **values}
+
     def kills(self, league_data_row):
         return league_data_row['kills']
 
     def winlose(self, league_data_row):
-        return league_data_row['result']
\ No newline at end of file
+        return league_data_row['result']
+
+    def assists(self, league_data_row):
+        return league_data_row['assists']
+
+    def deaths(self, league_data_row):
+        return league_data_row['deaths']
+
+    def cs(self, league_data_row):
+        return league_data_row['total cs']
+
+    def visionscore(self, league_data_row):
+        return league_data_row['visionscore']
+
+    def damage(self, league_data_row):
+        return league_data_row['damagetochampions']
@@ -1,14 +1,23 @@
 import argparse
 import datetime
+import os
 import subprocess
-import data
-import models
-from features import FeatureExtractor
-import numpy as np
 
-DATA_PATH = './data/2024_LoL_esports_match_data_from_OraclesElixir.csv'
+# Project modules pull in pandas, sklearn and scipy, so each command imports only what
+# it uses inside its function; `--help` and `interactive` stay fast. Keep it that way,
+# check_startup.py guards it.
+
+# One or more season files; globs and lists are merged by data.read_seasons
+DATA_PATH = './data/*_LoL_esports_match_data_from_OraclesElixir.csv'
 FEATURE_NAME_FILE = './features.txt'
-FEATURES_PATH = './checkpoints/checkpoint_20240901_234012/features.csv'
+FEATURES_PATH = './master_features'
+FEATURE_STORE_PATH = './feature_store'
+MASTER_FEATURES_PATH = FEATURES_PATH
+MODEL_PATH = './artifacts/poisson.npz'
+SWEEP_OUTPUT_PATH = './sweep_leaderboard.csv'
+SERVE_PORT = 8765
+PROFILE_PATH = './extract.prof'
+PROFILE_TOP = 30
 
 def parse_date(date_str):
     try:
@@ -16,22 +25,109 @@ def parse_date(date_str):
     except ValueError:
         raise argparse.ArgumentTypeError(f"Invalid date format: {date_str}. Use MM-DD-YYYY format.")
 
-def extract_features(start_date_str, end_date_str, label, feature_name_file):
-    start_date = parse_date(start_date_str)
-    end_date = parse_date(end_date_str)
-    df = data.read_data(DATA_PATH)
-    data.compute_features(df, start_date, end_date, label, features=data.get_features(feature_name_file))
+def load_history_frame(features, labels=(), data_path=DATA_PATH):
+    import data
+    return data.read_shared(data_path, columns=data.columns_for_features(features, labels))
+
+def extract_features(start_date, end_date, label, feature_name_file, engine='loop', workers=1, resume=None, profile=False, data_path=DATA_PATH):
+    import data
+    from metrics import ExtractionMetrics
+    from labels import label_names
+    features = data.get_features(feature_name_file)
+    df = load_history_frame(features, label_names(label), data_path)
+    metrics = ExtractionMetrics()
+    profiler = None
+    if profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if engine == 'vectorized':
+        data.compute_features_vectorized(df, start_date, end_date, label, features=features, metrics=metrics)
+    elif workers > 1 or resume:
+        data.compute_features_parallel(df, start_date, end_date, label, features=features, workers=workers, checkpoint_path=resume, metrics=metrics)
+    else:
+        data.compute_features(df, start_date, end_date, label, features=features, metrics=metrics)
+    if profiler is None:
+        print(metrics.summary())
+        return
+    profiler.disable()
+    import pstats
+    print(metrics.report())
+    profiler.dump_stats(PROFILE_PATH)
+    pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    print(f'Wrote raw profile to {PROFILE_PATH}')
 
-def backtest_simulate(model_type, features_path, feature_name_file):
-    X, Y = data.load_dataset(features_path, data.get_features(feature_name_file))
-    if model_type == 'poisson':
-        models.simulate_poisson(X, Y)
+def ingest_features(data_path, label, feature_name_file, store_path, output_path):
+    import data
+    from features import feature_windows
+    from store import FeatureStore
+    features = data.get_features(feature_name_file)
+    from labels import label_names
+    df = data.read_data(data_path, columns=data.columns_for_features(None, label_names(label)), compact=True)
+    store = FeatureStore(store_path, windows=feature_windows(features))
+    new_features = store.ingest(df, label, features=features)
+    part_path = data.append_features(new_features, output_path, features, label)
+    store.save()
+    print(f'Wrote {len(new_features)} rows to {part_path or output_path}, high-water mark {store.high_water_mark}')
 
-def run_inference(date_str, features_path, feature_name_file):
-    date = parse_date(date_str)
-    df = data.read_data(DATA_PATH)
-    X, Y = data.load_dataset(features_path, data.get_features(feature_name_file))
-    model = models.PoissonRegression(X, Y)
+def backtest_simulate(model_type, features_path, feature_name_file, refit_every=1, refit_by='rows', warm_start=False, workers=1, line=None):
+    import backtest
+    import data
+    X, Y, dates = data.load_dataset(features_path, data.get_features(feature_name_file), return_dates=True)
+    report, _ = backtest.walk_forward(
+        X, Y, dates, model_type=model_type, refit_every=refit_every, refit_by=refit_by,
+        warm_start=warm_start, workers=workers, lines=line)
+    for key, value in report.items():
+        print(f'{key}: {value}')
+
+def sweep_backtests(features_path, feature_name_files, model_types, alphas, refit_every=1, refit_by='rows', warm_start=False, workers=None, line=None, rank_by='log_likelihood', output_path=SWEEP_OUTPUT_PATH):
+    import backtest
+    import data
+    feature_lists = {path: data.get_features(path) for path in feature_name_files}
+    grid = backtest.sweep_grid(model_types, alphas, feature_lists)
+    leaderboard = backtest.sweep(
+        features_path, grid, workers=workers, rank_by=rank_by, refit_every=refit_every,
+        refit_by=refit_by, warm_start=warm_start, lines=line)
+    leaderboard.to_csv(output_path, index_label='rank')
+    print(leaderboard.to_string())
+    print(f'Wrote {len(leaderboard)} configurations to {output_path}')
+
+def train_model(features_path, feature_name_file, output_path, labels=None):
+    import data
+    import models
+    features = data.get_features(feature_name_file)
+    if not labels:
+        X, Y = data.load_dataset(features_path, features)
+        model = models.PoissonRegression(X, Y)
+        models.save_model(model, output_path, features, data.dataset_fingerprint(features_path, X, Y))
+        print(f'Saved model trained on {X.shape[0]} rows to {output_path}')
+        return
+    # One artifact per label, <output>_<label>.npz, fit on one shared scaled matrix
+    import numpy as np
+    X, Ys = data.load_targets(features_path, features, labels)
+    multi = models.MultiPoissonRegression(X, Ys)
+    for name, model in multi.models.items():
+        path = f"{os.path.splitext(output_path)[0]}_{name}.npz"
+        ok = np.isfinite(Ys[name])
+        models.save_model(model, path, features, data.dataset_fingerprint(features_path, X[ok], Ys[name][ok]))
+        print(f'Saved {name} model trained on {int(ok.sum())} rows to {path}')
+
+def load_model(features_path, features, model_path=None):
+    # A saved artifact if given, otherwise fit on the features file as before
+    import data
+    import models
+    if model_path:
+        return models.load_model(model_path, features)
+    X, Y = data.load_dataset(features_path, features)
+    return models.PoissonRegression(X, Y)
+
+def run_inference(date, features_path, feature_name_file, model_path=None):
+    import numpy as np
+    import data
+    from features import FeatureExtractor
+    from history import HistoryIndex
+    history = HistoryIndex(load_history_frame(data.get_features(feature_name_file)))
+    model = load_model(features_path, data.get_features(feature_name_file), model_path)
     while True:
         playername = input('Player Name: ')
         teamname = input('Team Name: ')
@@ -44,12 +140,71 @@ def run_inference(date_str, features_path, feature_name_file):
             opp_teamname=opp_teamname,
             position=position
         )
-        fe = FeatureExtractor(df, game)
+        fe = FeatureExtractor(history, game)
         input_nparr = np.array([[fe.extract(f) for f in data.get_features(feature_name_file)]])
         lam = model.predict(input_nparr)[0]
         lam = round(lam, 2)
         print(f'Prediction: {lam}')
 
+def run_slate_inference(date, features_path, feature_name_file, slate_path, output_path=None, model_path=None):
+    # Slate rows: date (optional, defaults to `date`), player, team, opponent, position, line
+    import numpy as np
+    import pandas as pd
+    import data
+    import pricing
+    from features import extract_batch
+    from history import HistoryIndex
+    features = data.get_features(feature_name_file)
+    history = HistoryIndex(load_history_frame(features))
+    model = load_model(features_path, features, model_path)
+    slate = pd.read_csv(slate_path)
+    dates = pd.to_datetime(slate['date']) if 'date' in slate.columns else pd.Series(date, index=slate.index)
+    games = [
+        data.Input(date=d, playername=row['player'], teamname=row['team'], opp_teamname=row['opponent'], position=row['position'])
+        for d, (_, row) in zip(dates, slate.iterrows())
+    ]
+    X_slate, skipped = extract_batch(history, games, features)
+    ok = np.array([i not in skipped for i in range(len(games))], dtype=bool)
+    lam = np.full(len(games), np.nan)
+    if ok.any():
+        lam[ok] = model.predict(X_slate[ok])
+    p_over, p_under, p_push = pricing.poisson_prices(lam, slate['line'].values)
+    slate['lambda'] = lam
+    slate['p_over'], slate['p_under'], slate['p_push'] = p_over, p_under, p_push
+    slate['skipped'] = [skipped.get(i, '') for i in range(len(games))]
+    output_path = output_path or f"{os.path.splitext(slate_path)[0]}_predictions.csv"
+    slate.to_csv(output_path, index=False)
+    print(f'Wrote {int(ok.sum())} predictions ({len(skipped)} skipped) to {output_path}')
+
+def serve_predictions(features_path, feature_name_file, model_path=None, host='127.0.0.1', port=SERVE_PORT, socket_path=None, max_batch=None, max_wait_ms=None):
+    import asyncio
+    import data
+    import service
+    from history import HistoryIndex
+    features = data.get_features(feature_name_file)
+    history = HistoryIndex(load_history_frame(features))
+    model = load_model(features_path, features, model_path)
+    app = service.PredictionService(
+        history, model, features,
+        max_batch=max_batch or service.MAX_BATCH,
+        max_wait=max_wait_ms / 1e3 if max_wait_ms is not None else service.MAX_WAIT_SECONDS)
+    try:
+        asyncio.run(app.serve(host, port, socket_path))
+    except KeyboardInterrupt:
+        pass
+
+def report_memory(feature_name_file):
+    import data
+    df = data.read_data(DATA_PATH)
+    print(data.memory_report(df, load_history_frame(data.get_features(feature_name_file), ['kills'])).to_string())
+
+def clear_shared(older_than_hours=None):
+    import shared
+    removed, freed = shared.clear(older_than_hours * 3600 if older_than_hours is not None else None)
+    for path in removed:
+        print(f'Removed {path}')
+    print(f'Freed {freed / 2**20:.1f} MB from {shared.SHM_DIR}')
+
 def run_interactive():
     subprocess.run(["streamlit", "run", "interactive.py"], check=True)
 
@@ -61,20 +216,81 @@ def main():
     extract_parser = subparsers.add_parser('extract', help='Extract features to create a feature file')
     extract_parser.add_argument('start_date', type=parse_date, help='Start date for feature extraction in MM-DD-YYYY format')
     extract_parser.add_argument('end_date', type=parse_date, help='End date for feature extraction in MM-DD-YYYY format')
-    extract_parser.add_argument('label', type=str, help='Label to use for feature extraction')
+    extract_parser.add_argument('label', type=str, help='Label to use for feature extraction, or several comma separated (e.g. kills,assists,deaths)')
     extract_parser.add_argument('feature_name_file', type=str, help='Path to the file with newline separated features', default=FEATURE_NAME_FILE)
+    extract_parser.add_argument('--engine', type=str, choices=['loop', 'vectorized'], default='loop', help='Per-row loop or whole-dataset vectorized extraction')
+    extract_parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for sharded loop extraction')
+    extract_parser.add_argument('--resume', type=str, default=None, help='Checkpoint directory of an interrupted sharded run to resume')
+    extract_parser.add_argument('--data', type=str, nargs='+', default=[DATA_PATH], help='Season files or globs to extract from, merged into one history')
+    extract_parser.add_argument('--profile', action='store_true', help=f'Print per-feature timings and a cProfile report of this process, raw stats to {PROFILE_PATH}')
+
+    # Incrementally extract features for newly published games
+    ingest_parser = subparsers.add_parser('ingest', help='Extract features for games not yet in the feature store')
+    ingest_parser.add_argument('data_path', type=str, nargs='+', help='Paths or globs of the OraclesElixir data drop, one file per season')
+    ingest_parser.add_argument('label', type=str, help='Label to use for feature extraction, or several comma separated')
+    ingest_parser.add_argument('feature_name_file', type=str, help='Path to the file with newline separated features', default=FEATURE_NAME_FILE)
+    ingest_parser.add_argument('--store', type=str, default=FEATURE_STORE_PATH, help='Feature store directory')
+    ingest_parser.add_argument('--output', type=str, default=MASTER_FEATURES_PATH, help='Features directory the new rows are added to, one Feather part per ingest')
 
     # Backtest/Simulate model
     backtest_parser = subparsers.add_parser('backtest', help='Backtest or simulate a model')
-    backtest_parser.add_argument('model_type', type=str, help='Type of model to use (e.g., poisson)')
-    backtest_parser.add_argument('features_path', type=str, help='Path to the features dataset', default='./checkpoints/checkpoint_20240901_234012/features.csv')
+    backtest_parser.add_argument('model_type', type=str, help='Type of model to use (poisson or bayesian)')
+    backtest_parser.add_argument('features_path', type=str, help='Path to the features dataset', default=FEATURES_PATH)
     backtest_parser.add_argument('feature_name_file', type=str, help='Path to the file with newline separated features', default='./features.txt')
+    backtest_parser.add_argument('--refit-every', type=int, default=1, help='Refit the model every N rows (or days with --refit-by day)')
+    backtest_parser.add_argument('--refit-by', type=str, choices=['rows', 'day'], default='rows', help='Refit cadence unit')
+    backtest_parser.add_argument('--warm-start', action='store_true', help='Start each refit from the previous coefficients')
+    backtest_parser.add_argument('--workers', type=int, default=1, help='Number of processes evaluating windows in parallel')
+    backtest_parser.add_argument('--line', type=float, default=None, help='Prop line to report hit rate against')
+
+    # Backtest a grid of models, regularization strengths and feature lists
+    sweep_parser = subparsers.add_parser('sweep', help='Backtest a grid of model configurations in parallel and rank them')
+    sweep_parser.add_argument('features_path', type=str, help='Path to the features dataset')
+    sweep_parser.add_argument('feature_name_files', type=str, nargs='+', help='Files of newline separated features, one feature list each')
+    sweep_parser.add_argument('--models', type=str, nargs='+', default=['poisson', 'bayesian'], help='Model types to sweep')
+    sweep_parser.add_argument('--alpha', type=float, nargs='+', default=[1.0], help='PoissonRegression L2 strengths to sweep')
+    sweep_parser.add_argument('--refit-every', type=int, default=1, help='Refit the model every N rows (or days with --refit-by day)')
+    sweep_parser.add_argument('--refit-by', type=str, choices=['rows', 'day'], default='rows', help='Refit cadence unit')
+    sweep_parser.add_argument('--warm-start', action='store_true', help='Warm start Poisson refits from the previous coefficients')
+    sweep_parser.add_argument('--workers', type=int, default=None, help='Number of processes (default: all CPUs)')
+    sweep_parser.add_argument('--line', type=float, default=None, help='Prop line to report hit rate against')
+    sweep_parser.add_argument('--rank-by', type=str, choices=['log_likelihood', 'mae', 'hit_rate'], default='log_likelihood', help='Leaderboard metric')
+    sweep_parser.add_argument('--output', type=str, default=SWEEP_OUTPUT_PATH, help='Where to write the leaderboard CSV')
+
+    # Train and save a model artifact
+    train_parser = subparsers.add_parser('train', help='Fit a model and save it as an artifact for inference')
+    train_parser.add_argument('features_path', type=str, help='Path to the features dataset', default=FEATURES_PATH)
+    train_parser.add_argument('feature_name_file', type=str, help='Path to the file with newline separated features', default=FEATURE_NAME_FILE)
+    train_parser.add_argument('--output', type=str, default=MODEL_PATH, help='Where to write the model artifact')
+    train_parser.add_argument('--labels', type=str, nargs='+', default=None, help='Train one model per label of a multi-label features file, written to <output>_<label>.npz')
 
     # Run inference
     inference_parser = subparsers.add_parser('inference', help='Run a singular prediction (inference)')
     inference_parser.add_argument('date', type=parse_date, help='Date of the game for prediction in MM-DD-YYYY format')
     inference_parser.add_argument('features_path', type=str, help='Path to the features dataset', default=FEATURES_PATH)
     inference_parser.add_argument('feature_name_file', type=str, help='Path to the file with newline separated features', default=FEATURE_NAME_FILE)
+    inference_parser.add_argument('--model', type=str, default=None, help='Model artifact from the train command; fits on features_path if omitted')
+    inference_parser.add_argument('--slate', type=str, default=None, help='CSV of props (date, player, team, opponent, position, line) to predict in one batch')
+    inference_parser.add_argument('--output', type=str, default=None, help='Where to write slate predictions (default: <slate>_predictions.csv)')
+
+    # Serve predictions to other local tools
+    serve_parser = subparsers.add_parser('serve', help='Serve micro-batched predictions as JSON over HTTP')
+    serve_parser.add_argument('features_path', type=str, nargs='?', help='Path to the features dataset', default=FEATURES_PATH)
+    serve_parser.add_argument('feature_name_file', type=str, nargs='?', help='Path to the file with newline separated features', default=FEATURE_NAME_FILE)
+    serve_parser.add_argument('--model', type=str, default=None, help='Model artifact from the train command; fits on features_path if omitted')
+    serve_parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    serve_parser.add_argument('--port', type=int, default=SERVE_PORT, help='TCP port to listen on')
+    serve_parser.add_argument('--socket', type=str, default=None, help='Listen on this Unix socket instead of TCP')
+    serve_parser.add_argument('--max-batch', type=int, default=None, help='Most games predicted in one batch')
+    serve_parser.add_argument('--max-wait-ms', type=float, default=None, help='How long a batch waits for more requests')
+
+    # Report memory saved by column projection and compaction
+    memory_parser = subparsers.add_parser('memory', help='Report memory use of the raw vs compacted match data')
+    memory_parser.add_argument('feature_name_file', type=str, nargs='?', help='Path to the file with newline separated features', default=FEATURE_NAME_FILE)
+
+    # Remove match data frames published to shared memory
+    clear_parser = subparsers.add_parser('clear-shared', help='Remove match data frames published to shared memory')
+    clear_parser.add_argument('--older-than-hours', type=float, default=None, help='Only remove frames not republished for this long')
 
     # Run interactive dashboard
     subparsers.add_parser('interactive', help='Run interactive panel')
@@ -82,11 +298,27 @@ def main():
     args = parser.parse_args()
 
     if args.command == 'extract':
-        extract_features(args.start_date, args.end_date, args.label, args.feature_name_file)
+        extract_features(args.start_date, args.end_date, args.label, args.feature_name_file, args.engine, args.workers, args.resume, args.profile, args.data)
+    elif args.command == 'ingest':
+        ingest_features(args.data_path, args.label, args.feature_name_file, args.store, args.output)
     elif args.command == 'backtest':
-        backtest_simulate(args.model_type, args.features_path, args.feature_name_file)
+        backtest_simulate(args.model_type, args.features_path, args.feature_name_file, args.refit_every, args.refit_by, args.warm_start, args.workers, args.line)
+    elif args.command == 'sweep':
+        sweep_backtests(args.features_path, args.feature_name_files, args.models, args.alpha, args.refit_every, args.refit_by,
+                        args.warm_start, args.workers, args.line, args.rank_by, args.output)
+    elif args.command == 'train':
+        train_model(args.features_path, args.feature_name_file, args.output, args.labels)
     elif args.command == 'inference':
-        run_inference(args.date, args.features_path, args.feature_name_file)
+        if args.slate:
+            run_slate_inference(args.date, args.features_path, args.feature_name_file, args.slate, args.output, args.model)
+        else:
+            run_inference(args.date, args.features_path, args.feature_name_file, args.model)
+    elif args.command == 'serve':
+        serve_predictions(args.features_path, args.feature_name_file, args.model, args.host, args.port, args.socket, args.max_batch, args.max_wait_ms)
+    elif args.command == 'memory':
+        report_memory(args.feature_name_file)
+    elif args.command == 'clear-shared':
+        clear_shared(args.older_than_hours)
     elif args.command == 'interactive':
         run_interactive()
     else:
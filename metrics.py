@@ -0,0 +1,113 @@
+from collections import Counter, defaultdict
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EVERY_SECONDS = 10.0
+
+class ExtractionMetrics:
+    """Counters for a feature extraction run.
+
+    Tracks time and calls per feature (history lookups are timed separately under
+    'lookup:<kind>' so they are not charged to whichever feature ran first),
+    HistoryIndex recency cache hits and misses, rows done against the expected
+    total for rows/sec and ETA, and skipped rows counted by reason. Counters from
+    several workers combine with merge().
+    """
+    def __init__(self, total=None):
+        self.total = total
+        self.rows = 0
+        self.extracted = 0
+        self.skips = Counter()
+        self.feature_seconds = defaultdict(float)
+        self.feature_calls = Counter()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.start = time.perf_counter()
+        self._last_progress = self.start
+
+    def time_feature(self, name, seconds):
+        self.feature_seconds[name] += seconds
+        self.feature_calls[name] += 1
+
+    def row_done(self, skip_reason=None):
+        if skip_reason is None:
+            self.add_rows(1)
+        else:
+            self.add_rows(0, {skip_reason: 1})
+
+    def add_rows(self, extracted, skips=None):
+        # Bulk form of row_done for engines that handle rows in batches
+        skips = {reason: count for reason, count in (skips or {}).items() if count}
+        self.rows += extracted + sum(skips.values())
+        self.extracted += extracted
+        self.skips.update(skips)
+        now = time.perf_counter()
+        if now - self._last_progress >= PROGRESS_EVERY_SECONDS:
+            self._last_progress = now
+            logger.info(self.progress_line())
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def rows_per_second(self):
+        elapsed = self.elapsed()
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+    def eta_seconds(self):
+        rate = self.rows_per_second()
+        if self.total is None or rate == 0:
+            return None
+        return max(self.total - self.rows, 0) / rate
+
+    def cache_hit_rate(self):
+        lookups = self.cache_hits + self.cache_misses
+        return self.cache_hits / lookups if lookups else 0.0
+
+    def progress_line(self):
+        eta = self.eta_seconds()
+        total = f"/{self.total}" if self.total is not None else ''
+        return (f"{self.rows}{total} rows, {self.rows_per_second():.1f} rows/s"
+                + (f", ETA {eta:.0f}s" if eta is not None else '') + f", skipped {sum(self.skips.values())}")
+
+    def merge(self, other):
+        # other may be an ExtractionMetrics or its to_dict()
+        other = other if isinstance(other, dict) else other.to_dict()
+        self.rows += other['rows']
+        self.extracted += other['extracted']
+        self.skips.update(other['skips'])
+        for name, seconds in other['feature_seconds'].items():
+            self.feature_seconds[name] += seconds
+        self.feature_calls.update(other['feature_calls'])
+        self.cache_hits += other['cache_hits']
+        self.cache_misses += other['cache_misses']
+
+    def to_dict(self):
+        return {
+            'rows': self.rows,
+            'extracted': self.extracted,
+            'skips': dict(self.skips),
+            'feature_seconds': dict(self.feature_seconds),
+            'feature_calls': dict(self.feature_calls),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
+
+    def summary(self):
+        skips = ', '.join(f"{reason}: {count}" for reason, count in self.skips.most_common()) or 'none'
+        return f"Extracted {self.extracted} rows in {self.elapsed():.1f}s ({self.rows_per_second():.1f} rows/s), skipped {skips}"
+
+    def report(self, top=None):
+        # Summary plus a per-feature timing table, slowest first
+        lines = [self.summary()]
+        if self.cache_hits + self.cache_misses:
+            lines.append(f"recency cache hit rate: {self.cache_hit_rate():.1%} ({self.cache_hits} hits, {self.cache_misses} misses)")
+        timed = sorted(self.feature_seconds.items(), key=lambda kv: kv[1], reverse=True)[:top]
+        total = sum(self.feature_seconds.values())
+        if timed:
+            lines.append(f"{'feature':<36} {'calls':>9} {'total s':>9} {'mean us':>9} {'share':>7}")
+            for name, seconds in timed:
+                calls = self.feature_calls[name]
+                lines.append(f"{name:<36} {calls:>9} {seconds:>9.3f} {seconds / calls * 1e6:>9.1f} {seconds / total:>7.1%}")
+        return '\n'.join(lines)
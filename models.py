@@ -1,10 +1,13 @@
+from datetime import datetime
+import json
+import os
 from sklearn import linear_model
 from scipy.stats import norm, poisson
 import numpy as np
-import data
-import matplotlib.pyplot as plt
 from sklearn.preprocessing import StandardScaler
 
+import pricing
+
 class BayesianRegression:
     def __init__(self, X, Y):
         self.X = X
@@ -20,26 +23,264 @@ class BayesianRegression:
         p_value = norm.cdf(pp_line, mu, sigma)[0]
         return p_value
 
+    def price(self, x, lines, num_games=1):
+        # (over, under, push) matrices of every row of x against every line
+        mu, sigma = self.predict(x)
+        return pricing.normal_board(mu, sigma, lines, num_games)
+
 class PoissonRegression:
-    def __init__(self, X, Y):
+    def __init__(self, X, Y, alpha=1.0, warm_start=None):
+        # warm_start: a previously fitted PoissonRegression whose coefficients seed the solver
         self.scaler = StandardScaler()
         self.X = self.scaler.fit_transform(X)
         self.Y = Y
-        self.clf = linear_model.PoissonRegressor()
+        self.clf = linear_model.PoissonRegressor(alpha=alpha, warm_start=warm_start is not None)
+        if warm_start is not None:
+            self.clf.coef_ = warm_start.clf.coef_.copy()
+            self.clf.intercept_ = warm_start.clf.intercept_
         self.clf.fit(self.X, self.Y)
 
     def predict(self, x):
-        return self.clf.predict(self.scaler.transform(x))
+        # PoissonRegressor's log link, from coef_/intercept_ only so loaded artifacts predict too
+        return np.exp(self.scaler.transform(x) @ self.clf.coef_ + self.clf.intercept_)
     
     def hit_percentage(self, x, pp_line):
         lam = self.predict(x)
         p_value = poisson.cdf(pp_line, lam)[0]
         return p_value
+
+    def price(self, x, lines, num_games=1):
+        # (over, under, push) matrices of every row of x against every line
+        return pricing.poisson_board(self.predict(x), lines, num_games)
     
     def abs_error(self, lam, labels):
         errors = np.abs(labels - lam)
         return np.sum(errors)
 
+    @classmethod
+    def from_scaled(cls, X_scaled, Y, scaler, alpha=1.0):
+        # Fit on a matrix `scaler` has already transformed; the scaler is shared, not refit
+        model = cls.__new__(cls)
+        model.scaler = scaler
+        model.X, model.Y = X_scaled, Y
+        model.clf = linear_model.PoissonRegressor(alpha=alpha)
+        model.clf.fit(X_scaled, Y)
+        return model
+
+class MultiPoissonRegression:
+    """One PoissonRegression per target, all fit on one scaled copy of the features.
+
+    `Ys` maps a target name to its labels; rows where a target is NaN are left out of
+    that target's fit only. Each entry of `models` is a plain PoissonRegression sharing
+    `scaler`, so it can be saved with save_model on its own.
+    """
+    def __init__(self, X, Ys, alpha=1.0):
+        self.scaler = StandardScaler()
+        X_scaled = self.scaler.fit_transform(X)
+        self.models = {}
+        for name, Y in Ys.items():
+            ok = np.isfinite(Y)
+            self.models[name] = PoissonRegression.from_scaled(X_scaled if ok.all() else X_scaled[ok], Y[ok], self.scaler, alpha)
+
+    def __getitem__(self, name):
+        return self.models[name]
+
+    def predict(self, x):
+        # name -> lam, scaling x once for every target
+        x_scaled = self.scaler.transform(x)
+        return {name: np.exp(x_scaled @ model.clf.coef_ + model.clf.intercept_) for name, model in self.models.items()}
+
+ARTIFACT_VERSION = 1
+
+def save_model(model, path, features, fingerprint=None):
+    """Write a fitted PoissonRegression as a versioned .npz artifact.
+
+    Holds the coefficients, the StandardScaler state, the ordered feature list the
+    model was trained on and an optional training data fingerprint.
+    """
+    meta = {
+        'version': ARTIFACT_VERSION,
+        'model_type': 'poisson',
+        'created': datetime.now().isoformat(),
+        'features': list(features),
+        'alpha': model.clf.alpha,
+        'fingerprint': fingerprint,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.tmp", 'wb') as f:
+        np.savez(
+            f,
+            meta=np.array(json.dumps(meta)),
+            coef=model.clf.coef_,
+            intercept=np.array(model.clf.intercept_),
+            scaler_mean=model.scaler.mean_,
+            scaler_scale=model.scaler.scale_,
+            scaler_var=model.scaler.var_,
+            scaler_n_samples_seen=np.array(model.scaler.n_samples_seen_),
+        )
+    os.replace(f"{path}.tmp", path)
+
+def load_model(path, features=None):
+    """Load a save_model artifact, checking it was trained on exactly `features` in order."""
+    with np.load(path, allow_pickle=False) as artifact:
+        meta = json.loads(str(artifact['meta']))
+        if meta['version'] != ARTIFACT_VERSION:
+            raise ValueError(f"Model artifact {path} has version {meta['version']}, expected {ARTIFACT_VERSION}")
+        if features is not None and list(features) != meta['features']:
+            raise ValueError(f"Model artifact {path} was trained on a different feature list")
+        model = PoissonRegression.__new__(PoissonRegression)
+        model.X, model.Y = None, None
+        model.scaler = StandardScaler()
+        model.scaler.mean_ = artifact['scaler_mean']
+        model.scaler.scale_ = artifact['scaler_scale']
+        model.scaler.var_ = artifact['scaler_var']
+        model.scaler.n_samples_seen_ = artifact['scaler_n_samples_seen'].item()
+        model.scaler.n_features_in_ = len(meta['features'])
+        model.clf = linear_model.PoissonRegressor(alpha=meta['alpha'])
+        model.clf.coef_ = artifact['coef']
+        model.clf.intercept_ = artifact['intercept'].item()
+        model.clf.n_features_in_ = len(meta['features'])
+    model.meta = meta
+    return model
+
+class OnlinePoissonRegression(PoissonRegression):
+    """PoissonRegression that absorbs new rows with partial_fit in O(features²) each.
+
+    The scaler is updated with running mean/variance and the coefficients with one
+    recursive IRLS (online Newton) step per row, using a Sherman-Morrison update of the
+    inverse curvature. Tolerance against a full refit on the same rows (max relative
+    error of lambda): ~0.2% after adding 10% more rows to the initial fit, ~3% after
+    doubling them, versus ~3% and ~7% for the stale initial model. Refit from scratch
+    periodically if tighter agreement is needed.
+    """
+    def __init__(self, X, Y, alpha=1.0):
+        super().__init__(X, Y, alpha=alpha)
+        self.alpha = alpha
+        self.n = len(Y)
+        M = self.X.shape[1]
+        Z = np.hstack([np.ones((self.n, 1)), self.X])
+        mu = self.clf.predict(self.X)
+        self.penalty = np.diag([0.0] + [alpha] * M)
+        self.H_inv = np.linalg.inv(Z.T @ (Z * mu[:, None]) / self.n + self.penalty)
+
+    def _rescale(self, mean, scale):
+        # Re-express coefficients and curvature in the updated scaler's space. The
+        # penalty is not scale invariant, so follow with a Newton step on the gradient
+        # it leaves behind (the data gradient was -penalty @ theta at the old optimum).
+        shift = (self.scaler.mean_ - mean) / scale
+        ratio = self.scaler.scale_ / scale
+        c, d = -shift / ratio, 1 / ratio
+        data_grad = np.concatenate([[0.0], -self.alpha * self.clf.coef_ * d])
+        self.clf.intercept_ += self.clf.coef_ @ shift
+        self.clf.coef_ = self.clf.coef_ * ratio
+        H_inv = self.H_inv.copy()
+        H_inv[1:] = c[:, None] * self.H_inv[0] + d[:, None] * self.H_inv[1:]
+        H_inv[:, 1:] = H_inv[:, [0]] * c[None, :] + H_inv[:, 1:] * d[None, :]
+        self.H_inv = H_inv
+        theta = np.concatenate([[self.clf.intercept_], self.clf.coef_])
+        theta = theta - self.H_inv @ (data_grad + self.penalty @ theta)
+        self.clf.intercept_, self.clf.coef_ = theta[0], theta[1:]
+
+    def partial_fit(self, x, y):
+        for xi, yi in zip(np.atleast_2d(x), np.atleast_1d(y)):
+            xi = xi.reshape(1, -1)
+            mean, scale = self.scaler.mean_.copy(), self.scaler.scale_.copy()
+            self.scaler.partial_fit(xi)
+            self._rescale(mean, scale)
+            z = np.concatenate([[1.0], self.scaler.transform(xi)[0]])
+            theta = np.concatenate([[self.clf.intercept_], self.clf.coef_])
+            mu = np.exp(z @ theta)
+            self.n += 1
+            G = self.H_inv * self.n / (self.n - 1)
+            Gu = G @ (z * np.sqrt(mu / self.n))
+            self.H_inv = G - np.outer(Gu, Gu) / (1 + Gu @ (z * np.sqrt(mu / self.n)))
+            theta = theta - self.H_inv @ (((mu - yi) * z + self.penalty @ theta) / self.n)
+            self.clf.intercept_, self.clf.coef_ = theta[0], theta[1:]
+        return self
+
+class OnlineBayesianRegression(BayesianRegression):
+    """BayesianRegression that absorbs new rows with a conjugate partial_fit in O(features²).
+
+    The intercept gets a flat prior, so predictions start identical to the batch fit.
+    Between re-estimates the noise and weight precisions (alpha_, lambda_) are held
+    fixed and partial_fit is the exact posterior update for them. XᵀX, Xᵀy, yᵀy and n
+    are kept as well, so refit_hyperparameters() reruns BayesianRidge's evidence
+    maximization over every row seen so far in O(features³), giving the batch fit's
+    predictions again; with refit_every it runs after that many new rows.
+
+    Without re-estimates, tolerance against a batch refit after doubling the rows: on
+    synthetic extraction features (lambda_ barely moving) mu within 0.2% and sigma 1%,
+    but when the new rows carry a signal the first ones lack (lambda_ 4.9e4 -> 84) the
+    median relative mu error is ~90%. After refit_hyperparameters it matches the batch
+    fit to rounding.
+    """
+    def __init__(self, X, Y, refit_every=None):
+        super().__init__(X, Y)
+        Xt = np.hstack([np.ones((len(Y), 1)), X])
+        self.refit_every = refit_every
+        self.n = len(Y)
+        self.G = Xt.T @ Xt
+        self.r = Xt.T @ Y
+        self.yy = float(Y @ Y)
+        self.pending = 0
+        self._update_posterior()
+
+    def _update_posterior(self):
+        prior = np.diag([0.0] + [self.clf.lambda_] * (len(self.r) - 1))
+        self.S = np.linalg.inv(prior + self.clf.alpha_ * self.G)
+        self._update_coef()
+
+    def _update_coef(self):
+        theta = self.clf.alpha_ * self.S @ self.r
+        self.clf.intercept_, self.clf.coef_ = theta[0], theta[1:]
+
+    def refit_hyperparameters(self):
+        # BayesianRidge's fixed-point updates of alpha_ and lambda_, on the centered
+        # sufficient statistics instead of the rows
+        clf, n = self.clf, self.n
+        x_mean, y_mean = self.G[0, 1:] / n, self.r[0] / n
+        eig, V = np.linalg.eigh(self.G[1:, 1:] - n * np.outer(x_mean, x_mean))
+        eig = np.maximum(eig, 0.0)
+        b = V.T @ (self.r[1:] - n * x_mean * y_mean)
+        yy = max(self.yy - n * y_mean ** 2, 0.0)
+        alpha = clf.alpha_init if clf.alpha_init is not None else 1.0 / (yy / n + np.finfo(np.float64).eps)
+        lambda_ = clf.lambda_init if clf.lambda_init is not None else 1.0
+        coef_old = None
+        for _ in range(clf.max_iter):
+            w = b / (eig + lambda_ / alpha)
+            rmse = max(yy - 2 * w @ b + w @ (eig * w), 0.0)
+            gamma = np.sum(alpha * eig / (lambda_ + alpha * eig))
+            lambda_ = (gamma + 2 * clf.lambda_1) / (w @ w + 2 * clf.lambda_2)
+            alpha = (n - gamma + 2 * clf.alpha_1) / (rmse + 2 * clf.alpha_2)
+            if coef_old is not None and np.sum(np.abs(coef_old - w)) < clf.tol:
+                break
+            coef_old = w
+        clf.alpha_, clf.lambda_ = alpha, lambda_
+        self._update_posterior()
+        self.pending = 0
+        return self
+
+    def partial_fit(self, x, y):
+        for xi, yi in zip(np.atleast_2d(x), np.atleast_1d(y)):
+            xt = np.concatenate([[1.0], xi])
+            Su = self.S @ xt
+            self.S = self.S - self.clf.alpha_ * np.outer(Su, Su) / (1 + self.clf.alpha_ * xt @ Su)
+            self.r = self.r + xt * yi
+            self.G = self.G + np.outer(xt, xt)
+            self.yy += yi * yi
+            self.n += 1
+            self.pending += 1
+            if self.refit_every and self.pending >= self.refit_every:
+                self.refit_hyperparameters()
+        self._update_coef()
+        return self
+
+    def predict(self, x):
+        # Same predictive std as BayesianRidge: coefficient covariance only, raw x
+        mu = x @ self.clf.coef_ + self.clf.intercept_
+        sigma = np.sqrt(1 / self.clf.alpha_ + np.sum((x @ self.S[1:, 1:]) * x, axis=1))
+        return mu, sigma
+
 def simulate_poisson(X, Y):
     N, M = X.shape[0], X.shape[1]
     losses = []
@@ -53,6 +294,8 @@ def simulate_poisson(X, Y):
     return losses
 
 # if __name__ == '__main__':
+#     import data
+#     import matplotlib.pyplot as plt
 #     with open('./features.txt', 'r') as f:
 #         features = f.read().split('\n')
 #     X, Y = data.load_dataset(
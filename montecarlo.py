@@ -0,0 +1,195 @@
+"""Monte Carlo pricing of correlated same-game props and multi-leg parlays.
+
+Each draw of a game samples a shared pace G ~ Gamma(shape, 1/shape) (mean 1), then each
+team's kills K ~ Poisson(rate * G); a team's deaths are the other team's kills. Player
+stats are sampled conditional on those totals:
+
+    kills    the team's kills split multinomially, player i taking kills_i / rate
+    deaths   the other team's kills split the same way by deaths_i / other rate
+    assists  Binomial(team kills - own kills, assists_i / (rate - kills_i))
+
+so a player's mean is their model's prediction while teammates, team totals and the
+two sides move together through K and G. Shares not covered by the given players go to
+the rest of the roster. Draws are made in seeded chunks to bound memory.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from features import extract_batch
+
+DRAWS = 1_000_000
+CHUNK_DRAWS = 250_000
+# Gamma shape of the shared game pace; larger is closer to independent Poisson teams.
+# fit_pace_shape estimates it from history
+PACE_SHAPE = 10.0
+
+PLAYER_STATS = ('kills', 'deaths', 'assists')
+TEAM_STATS = ('teamkills', 'teamdeaths')
+GAME_STATS = ('totalkills',)
+
+# subject: player or team name (None for GAME_STATS); side: 'over' or 'under'
+Leg = namedtuple('Leg', ['subject', 'stat', 'line', 'side'])
+
+def fit_pace_shape(df):
+    """Method-of-moments pace shape from per-game total kills in match data.
+
+    Var(T) = mu + mu^2 / shape for T ~ Poisson(mu * G). Differences in pace between
+    leagues and teams also count as overdispersion, so this errs towards correlation.
+    Returns inf when games are no more dispersed than Poisson.
+    """
+    players = df[df['position'] != 'team'] if 'position' in df.columns else df
+    totals = players.groupby('gameid', observed=True)['kills'].sum()
+    mu, var = totals.mean(), totals.var()
+    return mu ** 2 / (var - mu) if var > mu else np.inf
+
+def _shares(values, total):
+    # Per-player share of `total`, renormalized if the players alone exceed it
+    shares = np.asarray(values, dtype=np.float64) / total
+    return shares / shares.sum() if shares.sum() > 1 else shares
+
+def _split(rng, counts, shares):
+    # Joint multinomial split of `counts` for the given players, by conditional binomials
+    out = np.empty((len(shares), len(counts)), dtype=np.int64)
+    remaining, left = counts, 1.0
+    for i, share in enumerate(shares):
+        p = min(share / left, 1.0) if left > 0 else 0.0
+        out[i] = rng.binomial(remaining, p)
+        remaining = remaining - out[i]
+        left -= share
+    return out
+
+class SameGameSimulator:
+    """Joint simulation of one game between two teams.
+
+    `teams` maps each of the two team names to {'rate': expected team kills, 'players':
+    {playername: {'kills': .., 'deaths': .., 'assists': ..}}}, e.g. from build_game.
+    Player names must be unique across both teams.
+    """
+    def __init__(self, teams, pace_shape=PACE_SHAPE):
+        if len(teams) != 2:
+            raise ValueError(f"A game has two teams, got {list(teams)}")
+        self.teams = teams
+        self.pace_shape = pace_shape
+        self.names = list(teams)
+        self.team_of = {player: team for team, spec in teams.items() for player in spec['players']}
+
+    def _check(self, leg):
+        if leg.side not in ('over', 'under'):
+            raise ValueError(f"Leg side must be 'over' or 'under': {leg}")
+        if leg.stat in PLAYER_STATS and leg.subject in self.team_of:
+            return
+        if (leg.stat in TEAM_STATS and leg.subject in self.teams) or leg.stat in GAME_STATS:
+            return
+        raise ValueError(f"Can't simulate {leg.stat} for {leg.subject}")
+
+    def sample(self, rng, n, legs):
+        """(subject, stat) -> n draws, for every stat the legs refer to."""
+        a, b = self.names
+        if np.isinf(self.pace_shape):
+            pace = np.ones(n)
+        else:
+            pace = rng.gamma(self.pace_shape, 1 / self.pace_shape, n)
+        team_kills = {team: rng.poisson(self.teams[team]['rate'] * pace) for team in self.names}
+        other = {a: b, b: a}
+        out = {}
+        for team in self.names:
+            out[(team, 'teamkills')] = team_kills[team]
+            out[(team, 'teamdeaths')] = team_kills[other[team]]
+        out[(None, 'totalkills')] = team_kills[a] + team_kills[b]
+        needed = {(leg.subject, leg.stat) for leg in legs}
+        for team in self.names:
+            players = self.teams[team]['players']
+            rate, opp_rate = self.teams[team]['rate'], self.teams[other[team]]['rate']
+            killers = [p for p in players if (p, 'kills') in needed or (p, 'assists') in needed]
+            if killers:
+                kills = _split(rng, team_kills[team], _shares([players[p]['kills'] for p in killers], rate))
+                out.update({(p, 'kills'): kills[i] for i, p in enumerate(killers)})
+            dying = [p for p in players if (p, 'deaths') in needed]
+            if dying:
+                deaths = _split(rng, team_kills[other[team]], _shares([players[p]['deaths'] for p in dying], opp_rate))
+                out.update({(p, 'deaths'): deaths[i] for i, p in enumerate(dying)})
+            for p in killers:
+                if (p, 'assists') in needed:
+                    others = team_kills[team] - out[(p, 'kills')]
+                    share = players[p]['assists'] / max(rate - players[p]['kills'], 1e-9)
+                    out[(p, 'assists')] = rng.binomial(others, min(share, 1.0))
+        return out
+
+    def price(self, legs, draws=DRAWS, seed=0, chunk=CHUNK_DRAWS):
+        return price_parlay([(self, legs)], draws, seed, chunk)
+
+def _hits(values, leg):
+    return values > leg.line if leg.side == 'over' else values < leg.line
+
+def price_parlay(games, draws=DRAWS, seed=0, chunk=CHUNK_DRAWS):
+    """Probability that every leg wins, for legs over one or more independent games.
+
+    `games` is a list of (SameGameSimulator, legs). Legs in the same game are
+    correlated through the simulation; separate games are drawn independently. A push
+    (a stat landing exactly on the line) is not a win. Returns the parlay probability
+    and its Monte Carlo standard error, each leg's own probability and error, and the
+    product of the leg probabilities an independent pricing would give.
+    """
+    for game, legs in games:
+        for leg in legs:
+            game._check(leg)
+    seeds = np.random.SeedSequence(seed).spawn((draws + chunk - 1) // chunk)
+    all_legs = [leg for _, legs in games for leg in legs]
+    leg_wins = np.zeros(len(all_legs), dtype=np.int64)
+    wins = 0
+    for i, chunk_seed in enumerate(seeds):
+        rng = np.random.default_rng(chunk_seed)
+        n = min(chunk, draws - i * chunk)
+        hit = np.ones(n, dtype=bool)
+        j = 0
+        for game, legs in games:
+            sample = game.sample(rng, n, legs)
+            for leg in legs:
+                leg_hit = _hits(sample[(leg.subject, leg.stat)], leg)
+                leg_wins[j] += leg_hit.sum()
+                hit &= leg_hit
+                j += 1
+        wins += hit.sum()
+    p = wins / draws
+    leg_p = leg_wins / draws
+    return {
+        'p': float(p),
+        'se': float(np.sqrt(p * (1 - p) / draws)),
+        'legs': [{'leg': leg, 'p': float(q), 'se': float(np.sqrt(q * (1 - q) / draws))} for leg, q in zip(all_legs, leg_p)],
+        'independent_p': float(np.prod(leg_p)),
+        'draws': draws,
+    }
+
+def build_game(history, games, label_models, pace_shape=PACE_SHAPE):
+    """SameGameSimulator for the data.Input rows of both teams' players in one game.
+
+    Player means come from `label_models` (label name -> a model with the features it
+    was saved with in meta['features'], e.g. load_model artifacts from train --labels).
+    A team's rate averages, over its players, feat_teamkills (its own scoring) and
+    feat_opp_teamkills (what the opponent concedes). Players without enough history are
+    left out, their share going to the rest of the roster.
+    """
+    team_features = ['feat_teamkills', 'feat_opp_teamkills']
+    X_team, skipped = extract_batch(history, games, team_features)
+    preds = {}
+    for stat in PLAYER_STATS:
+        model = label_models[stat]
+        X, stat_skipped = extract_batch(history, games, model.meta['features'])
+        skipped.update(stat_skipped)
+        ok = ~np.isnan(X).any(axis=1)
+        preds[stat] = np.full(len(games), np.nan)
+        if ok.any():
+            preds[stat][ok] = model.predict(X[ok])
+    teams = {}
+    for i, game in enumerate(games):
+        team = teams.setdefault(game.teamname, {'rates': [], 'players': {}})
+        if not np.isnan(X_team[i]).any():
+            team['rates'].append(X_team[i].mean())
+        if i not in skipped:
+            team['players'][game.playername] = {stat: float(preds[stat][i]) for stat in PLAYER_STATS}
+    for name, team in teams.items():
+        if not team['rates']:
+            raise ValueError(f"Not enough history for a kill rate for {name}")
+        team['rate'] = float(np.mean(team.pop('rates')))
+    return SameGameSimulator(teams, pace_shape)
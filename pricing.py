@@ -0,0 +1,55 @@
+import numpy as np
+from scipy.special import gammaln, ndtr, pdtr, xlogy
+
+# Lines follow sportsbook convention: over wins on Y > line, under on Y < line and a
+# whole-number line pushes on Y == line. All functions broadcast their arguments, so
+# pass lam[:, None] and lines[None, :] (or use the *_board helpers) for a board.
+
+def total_rate(lam, num_games=1):
+    """Rate of a prop over a series: the per-map rates summed.
+
+    `lam` is either one per-map rate per row, repeated for `num_games` maps, or a
+    (rows, maps) array with one column per map, in which case num_games is ignored.
+    """
+    lam = np.asarray(lam, dtype=np.float64)
+    if lam.ndim == 2:
+        return lam.sum(axis=1)
+    return lam * np.asarray(num_games, dtype=np.float64)
+
+def poisson_pmf(k, lam):
+    k, lam = np.asarray(k, dtype=np.float64), np.asarray(lam, dtype=np.float64)
+    pmf = np.exp(xlogy(k, lam) - lam - gammaln(k + 1))
+    return np.where((k == np.floor(k)) & (k >= 0), pmf, np.where(np.isnan(lam), np.nan, 0.0))
+
+def poisson_prices(lam, lines):
+    # Elementwise (P(over), P(under), P(push)) for Y ~ Poisson(lam)
+    lam, lines = np.broadcast_arrays(np.asarray(lam, dtype=np.float64), np.asarray(lines, dtype=np.float64))
+    below = np.ceil(lines) - 1
+    under = np.where(below >= 0, pdtr(np.maximum(below, 0), lam), np.where(np.isnan(lam), np.nan, 0.0))
+    push = poisson_pmf(lines, lam)
+    return 1 - under - push, under, push
+
+def normal_prices(mu, sigma, lines):
+    # Elementwise (P(over), P(under), P(push)) for Y ~ Normal(mu, sigma); never pushes
+    mu, sigma, lines = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (mu, sigma, lines)))
+    under = ndtr((lines - mu) / sigma)
+    return 1 - under, under, np.where(np.isnan(under), np.nan, 0.0)
+
+def poisson_board(lam, lines, num_games=1):
+    """Price every row against every line: returns three (rows, lines) matrices.
+
+    `lam` holds per-map rates as for total_rate; `lines` is a grid shared by all rows.
+    """
+    rate = total_rate(lam, num_games)
+    return poisson_prices(rate[:, None], np.asarray(lines, dtype=np.float64)[None, :])
+
+def normal_board(mu, sigma, lines, num_games=1):
+    # As poisson_board for BayesianRegression's (mu, sigma); independent maps add variances
+    mu, sigma = np.asarray(mu, dtype=np.float64), np.asarray(sigma, dtype=np.float64)
+    if mu.ndim == 2:
+        mu, sigma = mu.sum(axis=1), np.sqrt((sigma ** 2).sum(axis=1))
+    else:
+        num_games = np.asarray(num_games, dtype=np.float64)
+        mu, sigma = mu * num_games, sigma * np.sqrt(num_games)
+    lines = np.asarray(lines, dtype=np.float64)[None, :]
+    return normal_prices(mu[:, None], sigma[:, None], lines)
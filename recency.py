@@ -0,0 +1,74 @@
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# mode 'games' / 'days': exponentially weighted mean with a half-life of n games / days;
+# mode 'last': plain mean of the last n games
+Window = namedtuple('Window', ['mode', 'n'])
+
+WINDOW_PATTERN = re.compile(r'^(?:ewm(\d+)([gd])|last(\d+))$')
+
+# Decayed sums are re-anchored every this many nats of decay so exp() stays finite
+ANCHOR_NATS = 300.0
+
+def parse_window(token):
+    # 'ewm10g' -> Window('games', 10), 'ewm30d' -> Window('days', 30), 'last5' -> Window('last', 5)
+    match = WINDOW_PATTERN.match(token)
+    if match is None:
+        raise ValueError(f"Unknown recency window: {token}")
+    if match.group(3):
+        n, mode = int(match.group(3)), 'last'
+    else:
+        n, mode = int(match.group(1)), 'games' if match.group(2) == 'g' else 'days'
+    if n < 1:
+        raise ValueError(f"Recency window must be at least 1: {token}")
+    return Window(mode, n)
+
+def window_token(window):
+    if window.mode == 'last':
+        return f'last{window.n}'
+    return f"ewm{window.n}{'g' if window.mode == 'games' else 'd'}"
+
+def recency_sums(starts, dates, x, p, window):
+    """Inclusive recency-weighted sums of x and p at every row.
+
+    Rows are sorted by key then date and `starts` marks each key's first row. For EWM
+    windows row k gets sum_i w_ik * x_i over the key's rows i <= k, where w_ik halves
+    every n rows or every n days between rows i and k, so only a decayed sum per key has
+    to be carried from one row to the next. For 'last' windows it is the sum over the
+    key's last n rows up to k. x and p are NaN-free (rows, columns) arrays; dividing the
+    two sums gives the weighted mean of x over rows where p is 1.
+    """
+    n_rows = len(starts)
+    pos = np.arange(n_rows)
+    first = np.maximum.accumulate(np.where(starts, pos, 0))
+    group = np.cumsum(starts) - 1
+    xp = np.hstack([x, p]).astype(np.float64)
+    if window.mode == 'last':
+        cum = pd.DataFrame(xp).groupby(group, sort=False).cumsum().to_numpy()
+        lag = pos - window.n
+        out = cum - np.where((lag >= first)[:, None], cum[np.maximum(lag, 0)], 0.0)
+    else:
+        if window.mode == 'games':
+            log_decay = np.full(n_rows, np.log(0.5) / window.n)
+        else:
+            dt = np.diff(dates.astype(np.int64), prepend=dates[:1].astype(np.int64)) / (86400e9 * window.n)
+            log_decay = np.log(0.5) * np.maximum(dt, 0.0)
+        log_decay[starts] = 0.0
+        decay = pd.Series(log_decay).groupby(group, sort=False).cumsum().to_numpy()
+        # Split each key's rows into segments spanning under ANCHOR_NATS of decay, each
+        # summed relative to its first row; rows more than a segment back weigh < e^-ANCHOR_NATS
+        epoch = np.floor(-decay / ANCHOR_NATS)
+        seg_start = starts.copy()
+        seg_start[1:] |= epoch[1:] != epoch[:-1]
+        seg_first = np.maximum.accumulate(np.where(seg_start, pos, 0))
+        anchor = decay[seg_first]
+        scaled = np.exp(anchor - decay)[:, None] * xp
+        out = np.exp(decay - anchor)[:, None] * pd.DataFrame(scaled).groupby(np.cumsum(seg_start), sort=False).cumsum().to_numpy()
+        prev_end = np.maximum(seg_first - 1, 0)
+        carried = ~starts[seg_first]
+        out += np.where(carried[:, None], np.exp(np.minimum(decay - decay[prev_end], 0.0))[:, None] * out[prev_end], 0.0)
+    m = x.shape[1]
+    return out[:, :m], out[:, m:]
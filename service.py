@@ -0,0 +1,293 @@
+"""Local prediction service: JSON over HTTP on a TCP port or a Unix socket.
+
+Keeps the HistoryIndex, its lookup caches and the fitted model in memory. Predict
+requests that arrive within `max_wait` of each other are answered by one extract_batch
+and one predict call. Endpoints:
+
+    POST /predict  {"player", "team", "opponent", "position", "date"?, "line"?}
+                   or {"games": [...]}; date defaults to now
+    GET  /metrics  request, game and batch counters, throughput and latency percentiles
+    GET  /health
+
+    curl -s localhost:8765/predict -d '{"player": "Faker", "team": "T1", "opponent": "Gen.G", "position": "mid", "line": 3.5}'
+"""
+import asyncio
+from collections import deque
+import json
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import data
+import pricing
+from features import extract_batch
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 256
+MAX_WAIT_SECONDS = 0.005
+# Latency percentiles are over the most recent requests
+LATENCY_WINDOW = 10000
+MAX_BODY_BYTES = 1 << 20
+GAME_FIELDS = ('player', 'team', 'opponent', 'position')
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class ServiceMetrics:
+    """Counters since start, plus latencies of the last LATENCY_WINDOW requests."""
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.errors = 0
+        self.games = 0
+        self.skipped = 0
+        self.batches = 0
+        self.batch_seconds = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def request_done(self, seconds, error=False):
+        self.requests += 1
+        self.errors += error
+        self.latencies.append(seconds)
+
+    def batch_done(self, games, skipped, seconds):
+        self.batches += 1
+        self.games += games
+        self.skipped += skipped
+        self.batch_seconds += seconds
+
+    def to_dict(self):
+        uptime = time.perf_counter() - self.start
+        latencies = np.array(self.latencies) * 1e3
+        percentiles = np.percentile(latencies, [50, 95, 99]) if len(latencies) else [None] * 3
+        return {
+            'uptime_seconds': uptime,
+            'requests': self.requests,
+            'errors': self.errors,
+            'games': self.games,
+            'skipped': self.skipped,
+            'batches': self.batches,
+            'mean_batch_size': self.games / self.batches if self.batches else None,
+            'mean_batch_ms': self.batch_seconds / self.batches * 1e3 if self.batches else None,
+            'requests_per_second': self.requests / uptime,
+            'games_per_second': self.games / uptime,
+            'latency_ms': dict(zip(['p50', 'p95', 'p99'], (float(p) if p is not None else None for p in percentiles))),
+        }
+
+def parse_game(obj):
+    missing = [field for field in GAME_FIELDS if not obj.get(field)]
+    if missing:
+        raise RequestError(400, f"Missing fields: {', '.join(missing)}")
+    wrong = [field for field in GAME_FIELDS if not isinstance(obj[field], str)]
+    if obj.get('date') and not isinstance(obj['date'], str):
+        wrong.append('date')
+    line = obj.get('line')
+    if line is not None and (isinstance(line, bool) or not isinstance(line, (int, float))):
+        wrong.append('line')
+    if wrong:
+        raise RequestError(400, f"Wrong types for: {', '.join(wrong)} (strings, and a number for line)")
+    try:
+        date = pd.Timestamp(obj['date']) if obj.get('date') else pd.Timestamp.now()
+        line = float(line) if line is not None else None
+    except (ValueError, TypeError) as e:
+        raise RequestError(400, str(e))
+    if date is pd.NaT:
+        raise RequestError(400, 'Invalid date')
+    if line is not None and not np.isfinite(line):
+        raise RequestError(400, 'Line must be finite')
+    game = data.Input(date=date, playername=obj['player'], teamname=obj['team'], opp_teamname=obj['opponent'], position=obj['position'])
+    return game, line
+
+class Predictor:
+    """Micro-batches predict requests onto one feature build and model call."""
+    def __init__(self, history, model, features, metrics, max_batch=MAX_BATCH, max_wait=MAX_WAIT_SECONDS):
+        self.history = history
+        self.model = model
+        self.features = features
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+
+    async def predict(self, games):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((games, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self.queue.get()]
+            size = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), max(deadline - loop.time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                size += len(item[0])
+            games = [game for request_games, _ in pending for game in request_games]
+            # Off the event loop so connections keep being accepted; one batch at a time,
+            # so the history caches are never used from two threads
+            try:
+                results = await loop.run_in_executor(None, self._predict_batch, games)
+            except Exception:
+                logger.exception(f'Batch of {len(pending)} requests failed, retrying them one by one')
+                await self._run_separately(loop, pending)
+                continue
+            start = 0
+            for request_games, future in pending:
+                if not future.cancelled():
+                    future.set_result(results[start:start + len(request_games)])
+                start += len(request_games)
+
+    async def _run_separately(self, loop, pending):
+        # A request that breaks a batch fails alone instead of with everything batched with it
+        for request_games, future in pending:
+            if future.cancelled():
+                continue
+            try:
+                future.set_result(await loop.run_in_executor(None, self._predict_batch, request_games))
+            except Exception as e:
+                future.set_exception(e)
+
+    def _predict_batch(self, games):
+        start = time.perf_counter()
+        X, skipped = extract_batch(self.history, [game for game, _ in games], self.features)
+        ok = np.array([i not in skipped for i in range(len(games))], dtype=bool)
+        lam = np.full(len(games), np.nan)
+        if ok.any():
+            lam[ok] = self.model.predict(X[ok])
+        lines = np.array([np.nan if line is None else line for _, line in games])
+        p_over, p_under, p_push = pricing.poisson_prices(lam, lines)
+        results = []
+        for i, (_, line) in enumerate(games):
+            if i in skipped:
+                results.append({'skipped': skipped[i]})
+                continue
+            result = {'lambda': float(lam[i])}
+            if line is not None:
+                result.update({'line': line, 'p_over': float(p_over[i]), 'p_under': float(p_under[i]), 'p_push': float(p_push[i])})
+            results.append(result)
+        self.metrics.batch_done(len(games), len(skipped), time.perf_counter() - start)
+        return results
+
+async def _read_request(reader):
+    # (method, path, headers, body), or None once the client has closed the connection
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise RequestError(400, 'Malformed request line')
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise RequestError(400, 'Invalid Content-Length')
+    if length > MAX_BODY_BYTES:
+        raise RequestError(413, f'Body over {MAX_BODY_BYTES} bytes')
+    body = await reader.readexactly(length) if length else b''
+    return method, path.split('?', 1)[0], headers, body
+
+def _response(status, payload, keep_alive):
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + body
+
+class PredictionService:
+    def __init__(self, history, model, features, max_batch=MAX_BATCH, max_wait=MAX_WAIT_SECONDS):
+        self.metrics = ServiceMetrics()
+        self.predictor = Predictor(history, model, features, self.metrics, max_batch, max_wait)
+
+    async def handle(self, method, path, body):
+        if path == '/health':
+            return {'status': 'ok'}
+        if path == '/metrics':
+            return self.metrics.to_dict()
+        if path != '/predict':
+            raise RequestError(404, f'No endpoint {path}')
+        if method != 'POST':
+            raise RequestError(405, 'Use POST for /predict')
+        try:
+            request = json.loads(body)
+        except ValueError as e:
+            raise RequestError(400, f'Invalid JSON: {e}')
+        if not isinstance(request, dict):
+            raise RequestError(400, 'Expected a JSON object')
+        if 'games' in request:
+            if not isinstance(request['games'], list) or not all(isinstance(g, dict) for g in request['games']):
+                raise RequestError(400, "'games' must be a list of objects")
+            results = await self.predictor.predict([parse_game(g) for g in request['games']])
+            return {'predictions': results}
+        return (await self.predictor.predict([parse_game(request)]))[0]
+
+    async def serve_connection(self, reader, writer):
+        # HTTP/1.1 with keep-alive, so a load generator can reuse its connections
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except RequestError as e:
+                    writer.write(_response(e.status, {'error': str(e)}, keep_alive=False))
+                    await writer.drain()
+                    break
+                except (ValueError, asyncio.IncompleteReadError):
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                start = time.perf_counter()
+                try:
+                    status, payload = 200, await self.handle(method, path, body)
+                except RequestError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e:
+                    logger.exception('Request failed')
+                    status, payload = 500, {'error': str(e)}
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if path == '/predict':
+                    self.metrics.request_done(time.perf_counter() - start, error=status != 200)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=None, socket_path=None):
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = await asyncio.start_unix_server(self.serve_connection, path=socket_path)
+            where = socket_path
+        else:
+            server = await asyncio.start_server(self.serve_connection, host, port)
+            where = f'http://{host}:{port}'
+        batcher = asyncio.create_task(self.predictor.run())
+        print(f'Serving predictions on {where}', flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if socket_path and os.path.exists(socket_path):
+                os.remove(socket_path)
@@ -0,0 +1,104 @@
+"""Match history frames shared between local processes through memory-mapped Arrow files.
+
+publish() writes a frame as an uncompressed Arrow IPC file, by default in /dev/shm, and
+attach() maps it read-only and wraps it in a DataFrame without copying: numeric and
+date columns are views of the mapping, categoricals keep their codes there. However
+many processes attach, the operating system holds one copy of the data.
+
+Attached frames are read-only; take a copy before modifying one in place.
+
+Lifecycle: a published frame stays until a newer version of the same source replaces
+it or clear() removes it, so later runs attach instead of rebuilding. Every projection
+(set of columns) is its own source, and /dev/shm is RAM, so clear them when done with
+`python main.py clear-shared` (e.g. after a data update or from a nightly job).
+Removing a file does not affect processes that have it mapped; the next load()
+publishes it again. Frames a single run publishes for its own workers, like the
+parallel extraction's, are removed by that run.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+PREFIX = 'lolbetting'
+
+def shared_path(source, version):
+    """Path of a published frame: one per `source` (what was loaded), `version` of it.
+
+    Both are JSON-serializable; publishing a new version removes the older ones.
+    """
+    def digest(obj):
+        return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()[:16]
+    return os.path.join(SHM_DIR, f"{PREFIX}-{digest(source)}-{digest(version)}.arrow")
+
+def _to_arrow(col):
+    if col.dtype == object:
+        col = col.astype('category')
+    if col.dtype.kind == 'f':
+        # NaN stays a float value rather than becoming a null, so attach() can skip the copy
+        return pa.array(col.to_numpy(), from_pandas=False)
+    return pa.Array.from_pandas(col)
+
+def publish(df, path):
+    """Write `df` (index dropped) where attach() can map it; atomic, so readers never see a partial file."""
+    table = pa.table({column: _to_arrow(df[column]) for column in df.columns})
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        # One record batch, so every column is a single contiguous buffer
+        writer.write_table(table, max_chunksize=max(len(df), 1))
+    os.replace(tmp, path)
+    stem = os.path.basename(path).rsplit('-', 1)[0]
+    for name in os.listdir(os.path.dirname(path)):
+        if name.startswith(f"{stem}-") and name.endswith('.arrow') and name != os.path.basename(path):
+            # Processes still attached to an old version keep their mapping
+            os.remove(os.path.join(os.path.dirname(path), name))
+    logger.info(f"Published {len(df)} rows to {path} ({table.nbytes / 2**20:.1f} MB)")
+    return path
+
+def attach(path, columns=None):
+    """Read-only, zero-copy DataFrame over a published frame, optionally only `columns`."""
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    if columns:
+        table = table.select([c for c in table.column_names if c in columns])
+    return table.to_pandas(split_blocks=True, self_destruct=False)
+
+def load(source, version, build, columns=None):
+    """Attach to the published (source, version) frame, building and publishing it first if missing."""
+    path = shared_path(source, version)
+    if os.path.exists(path):
+        try:
+            return attach(path, columns)
+        except FileNotFoundError:
+            pass  # cleared between the check and the open
+    publish(build(), path)
+    return attach(path, columns)
+
+def clear(older_than=None):
+    """Remove published frames (and leftovers of interrupted publishes) from SHM_DIR.
+
+    `older_than` in seconds keeps frames modified more recently. Returns the removed
+    paths and the bytes they held.
+    """
+    removed, freed = [], 0
+    for name in os.listdir(SHM_DIR):
+        path = os.path.join(SHM_DIR, name)
+        if not name.startswith(f"{PREFIX}-"):
+            continue
+        try:
+            stat = os.stat(path)
+            if older_than is not None and time.time() - stat.st_mtime < older_than:
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        removed.append(path)
+        freed += stat.st_size
+    logger.info(f"Removed {len(removed)} shared frames ({freed / 2**20:.1f} MB)")
+    return removed, freed
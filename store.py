@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from pyarrow import feather
+
+from features import FEATURE_SPECS, MIN_GAMES, NotEnoughDataException, compute_feature_frame, feature_keys, feature_spec, feature_state, feature_windows, state_stats
+from labels import LabelExtractor, label_columns
+from recency import parse_window, window_token
+
+logger = logging.getLogger(__name__)
+
+STORE_VERSION = 1
+# Names the generation directory the store currently reads from
+CURRENT_FILE = 'CURRENT'
+
+class FeatureStore:
+    """Persistent running aggregates for incremental feature extraction.
+
+    Keeps, per player and per (opponent team, position), the row count and the
+    non-NaN count and sum of every stat over all ingested games, plus the set of
+    ingested gameids and the latest ingested date (the high-water mark). Ingesting a
+    data drop computes features for the new games only and advances the state, so the
+    cost is proportional to the new rows rather than the whole history.
+
+    `windows` lists the recency.Window variants to keep decayed state for; they are
+    fixed when the store is created since the state cannot be rebuilt from totals.
+    """
+    def __init__(self, path=None, windows=()):
+        # path=None keeps the store in memory only
+        self.path = path
+        self.windows = list(windows)
+        self.state = None
+        self.gameids = set()
+        self.high_water_mark = None
+        # Per kind, keys of ingested rows dated at the high-water mark; None for stores
+        # saved before these were kept
+        self.boundary = {}
+        self._means = None
+        if path and os.path.exists(self._meta_path(self._current_dir())):
+            self._load()
+            if windows and set(windows) != set(self.windows):
+                raise ValueError(f"Feature store {path} keeps recency windows {[window_token(w) for w in self.windows]}, "
+                                 f"rebuild it to use {[window_token(w) for w in windows]}")
+
+    def _current_dir(self):
+        # Stores saved before generations were introduced keep their files in path itself
+        pointer = os.path.join(self.path, CURRENT_FILE)
+        if not os.path.exists(pointer):
+            return self.path
+        with open(pointer, 'r') as f:
+            return os.path.join(self.path, f.read().strip())
+
+    @staticmethod
+    def _meta_path(directory):
+        return os.path.join(directory, 'meta.json')
+
+    @staticmethod
+    def _state_path(directory, kind):
+        return os.path.join(directory, f'{kind}.feather')
+
+    def ingest(self, df, label=None, features=None):
+        """Add the games of `df` not ingested yet and return their feature rows.
+
+        The result has the same columns compute_features writes; pass features=[] to
+        only advance the state. Games dated before the high-water mark are added to the
+        state, but no feature rows are returned for them since the state already holds
+        games after them. Games at exactly the high-water mark get their rows unless a
+        game ingested at that time shares a player or opponent key with them.
+        """
+        features = list(FEATURE_SPECS.keys()) if features is None else features
+        missing = [window_token(w) for w in feature_windows(features) if w not in self.windows]
+        if missing:
+            raise ValueError(f"Feature store does not keep recency windows {missing}")
+        new = df[~df['gameid'].isin(list(self.gameids))]
+        if new.empty:
+            return pd.DataFrame(columns=list(df.columns) + features + (label_columns(label) if label else []))
+        keys = feature_keys(new)
+        late = pd.Series(False, index=new.index)
+        if self.high_water_mark is not None:
+            late = new['date'] < self.high_water_mark
+            # The state already counts the games at the high-water mark, which a row at
+            # that time must not see; only rows whose keys they touch are affected
+            at_mark = (new['date'] == self.high_water_mark).to_numpy()
+            if self.boundary is None:
+                late |= at_mark
+            else:
+                for kind, index in keys.items():
+                    late |= at_mark & index.isin(list(self.boundary.get(kind, ())))
+            if late.any():
+                logger.warning(f"{int(late.sum())} rows predate the high-water mark {self.high_water_mark}, not emitting features for them")
+
+        feature_df, valid = compute_feature_frame(new, features, base=self.state)
+        keep = valid & ~late & (new['playername'] != 'unknown player')
+        mod_df = pd.concat([new[keep], feature_df[keep]], axis=1)
+        if label:
+            for column, values in LabelExtractor().extract_all(mod_df, label).items():
+                mod_df[column] = values
+
+        self.state = feature_state(new, self.windows, base=self.state)
+        self._means = None
+        self.gameids.update(new['gameid'].astype(str))
+        latest = new['date'].max()
+        if self.high_water_mark is None or latest > self.high_water_mark:
+            self.boundary = {}
+        if self.boundary is not None and (self.high_water_mark is None or latest >= self.high_water_mark):
+            at_latest = (new['date'] == latest).to_numpy()
+            for kind, index in keys.items():
+                self.boundary.setdefault(kind, set()).update(index[at_latest])
+        self.high_water_mark = latest if self.high_water_mark is None else max(self.high_water_mark, latest)
+        logger.info(f"Ingested {new['gameid'].nunique()} games, {len(mod_df)} feature rows, high-water mark {self.high_water_mark}")
+        return mod_df
+
+    def _latest_means(self):
+        if self._means is None:
+            self._means = {}
+            for kind, frame in self.state.items():
+                # Columns are the stat for all-history means, '<window token>:<stat>' for recency ones
+                stats = state_stats(frame)
+                counts = frame[[f'count_{s}' for s in stats]].to_numpy()
+                sums = frame[[f'sum_{s}' for s in stats]].to_numpy()
+                for window in self.windows:
+                    token = window_token(window)
+                    if window.mode == 'last':
+                        slots = np.stack([frame[[f'{token}:{i}_{s}' for s in stats]].to_numpy(dtype=np.float64) for i in range(window.n)])
+                        recent_sums, weights = np.nansum(slots, axis=0), (~np.isnan(slots)).sum(axis=0)
+                    else:
+                        recent_sums = frame[[f'{token}:sum_{s}' for s in stats]].to_numpy()
+                        weights = frame[[f'{token}:weight_{s}' for s in stats]].to_numpy()
+                    counts, sums = np.hstack([counts, weights]), np.hstack([sums, recent_sums])
+                labels = stats + [f'{window_token(w)}:{s}' for w in self.windows for s in stats]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    self._means[kind] = (frame['rows'], pd.DataFrame(sums / counts, index=frame.index, columns=labels))
+        return self._means
+
+    def latest(self, game, features):
+        """Feature vector for a data.Input dated after the high-water mark.
+
+        A keyed lookup into the running totals, giving what FeatureExtractor would over
+        all ingested games. Raises NotEnoughDataException the same way it does.
+        """
+        keys = {'player': (game.playername,), 'opp': (game.opp_teamname, game.position)}
+        rows_by_kind = {}
+        values = []
+        for name in features:
+            kind, stat, window = feature_spec(name)
+            column = stat if window is None else f'{window_token(window)}:{stat}'
+            if kind not in rows_by_kind:
+                rows, means = self._latest_means()[kind]
+                if keys[kind] not in rows.index or rows[keys[kind]] < MIN_GAMES:
+                    raise NotEnoughDataException('not enough player history' if kind == 'player' else 'not enough opponent history')
+                rows_by_kind[kind] = means.loc[keys[kind]]
+            if column not in rows_by_kind[kind].index:
+                raise ValueError(f"Feature store keeps no {stat} state for {name}")
+            values.append(float(rows_by_kind[kind][column]))
+        return values
+
+    def players(self):
+        return sorted(self.state['player'].index.get_level_values(0)) if self.state else []
+
+    def teams(self):
+        return sorted(self.state['opp'].index.get_level_values(0).unique()) if self.state else []
+
+    def save(self):
+        """Write the state as a new generation directory, then point CURRENT at it.
+
+        Replacing the pointer is the only step readers see, so a crash at any point
+        leaves the previous generation whole. Older generations are removed afterwards.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        generation = tempfile.mkdtemp(prefix='gen-', dir=self.path)
+        for kind, frame in (self.state or {}).items():
+            names = [f'key{i}' for i in range(frame.index.nlevels)]
+            feather.write_feather(frame.rename_axis(names).reset_index(), self._state_path(generation, kind))
+        meta = {
+            'version': STORE_VERSION,
+            'kinds': list((self.state or {}).keys()),
+            'windows': [window_token(w) for w in self.windows],
+            'high_water_mark': self.high_water_mark.isoformat() if self.high_water_mark is not None else None,
+            'gameids': sorted(self.gameids),
+            'boundary': {kind: [list(key) for key in keys] for kind, keys in self.boundary.items()} if self.boundary is not None else None,
+        }
+        with open(self._meta_path(generation), 'w') as f:
+            json.dump(meta, f)
+        pointer = os.path.join(self.path, CURRENT_FILE)
+        with open(f'{pointer}.tmp', 'w') as f:
+            f.write(os.path.basename(generation))
+        os.replace(f'{pointer}.tmp', pointer)
+        for name in os.listdir(self.path):
+            full = os.path.join(self.path, name)
+            if name.startswith('gen-') and full != generation:
+                shutil.rmtree(full, ignore_errors=True)
+            elif name == 'meta.json' or name.endswith('.feather'):
+                # Files of a store saved before generations
+                os.remove(full)
+
+    def _load(self):
+        directory = self._current_dir()
+        with open(self._meta_path(directory), 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != STORE_VERSION:
+            raise ValueError(f"Feature store {self.path} has version {meta['version']}, expected {STORE_VERSION}")
+        self.state = {}
+        for kind in meta['kinds']:
+            frame = feather.read_feather(self._state_path(directory, kind))
+            names = [c for c in frame.columns if c.startswith('key')]
+            # Levels stay unnamed like aggregate_state's, or adding new totals can't align them
+            self.state[kind] = frame.drop(columns=names).set_axis(pd.MultiIndex.from_frame(frame[names], names=[None] * len(names)))
+        self.state = self.state or None
+        self.windows = [parse_window(token) for token in meta.get('windows', [])]
+        self._means = None
+        self.gameids = set(meta['gameids'])
+        boundary = meta.get('boundary')
+        self.boundary = {kind: {tuple(key) for key in keys} for kind, keys in boundary.items()} if boundary is not None else None
+        self.high_water_mark = pd.Timestamp(meta['high_water_mark']) if meta['high_water_mark'] else None
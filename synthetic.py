@@ -0,0 +1,209 @@
+"""Seeded generator of fake OraclesElixir-shaped match data.
+
+Each game has 10 player rows (top/jng/mid/bot/sup for the blue then the red side)
+with the metadata columns and every stat in features.STATS. Teams play within
+leagues of ten on a schedule spread over roughly a season per 10k games, rosters have
+occasional substitutes, a few rows are 'unknown player' and partial-completeness
+leagues leave the @10/15/20/25 stats empty like the real files do. Usage:
+
+    python synthetic.py GAMES OUT.csv [--seed N]
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from features import STATS
+
+POSITIONS = ['top', 'jng', 'mid', 'bot', 'sup']
+TEAMS_PER_LEAGUE = 10
+GAMES_PER_TEAM = 50
+GAMES_PER_YEAR = 10000
+CHUNK_GAMES = 5000
+UNKNOWN_PLAYER_RATE = 0.005
+SUB_RATE = 0.05
+PARTIAL_LEAGUE_RATE = 0.2
+
+# Per-position shares and rates, in POSITIONS order
+KILL_SHARE = np.array([0.18, 0.17, 0.25, 0.32, 0.08])
+DEATH_SHARE = np.array([0.22, 0.20, 0.20, 0.20, 0.18])
+ASSIST_RATE = np.array([0.45, 0.65, 0.55, 0.50, 0.75])
+CSPM = np.array([8.0, 5.8, 8.6, 9.2, 1.2])
+EARNED_GPM = np.array([255.0, 220.0, 275.0, 305.0, 115.0])
+DPM = np.array([560.0, 380.0, 650.0, 700.0, 220.0])
+DTPM = np.array([760.0, 800.0, 560.0, 560.0, 500.0])
+VSPM = np.array([1.0, 1.4, 1.1, 1.1, 2.7])
+
+LEAGUE_NAMES = ['LCK', 'LPL', 'LEC', 'LCS', 'PCS', 'VCS', 'CBLOL', 'LLA', 'LJL', 'TCL']
+
+class _League:
+    # Teams, rosters and strengths shared by every chunk of a generated file
+    def __init__(self, n_games, rng):
+        self.n_teams = max(TEAMS_PER_LEAGUE, -(-2 * n_games // GAMES_PER_TEAM) // TEAMS_PER_LEAGUE * TEAMS_PER_LEAGUE)
+        self.n_leagues = self.n_teams // TEAMS_PER_LEAGUE
+        self.strength = rng.normal(0.0, 0.8, self.n_teams)
+        self.partial = rng.random(self.n_leagues) < PARTIAL_LEAGUE_RATE
+        self.league_names = np.array([
+            LEAGUE_NAMES[i % len(LEAGUE_NAMES)] + (f' {i // len(LEAGUE_NAMES) + 1}' if i >= len(LEAGUE_NAMES) else '')
+            for i in range(self.n_leagues)
+        ], dtype=object)
+        self.team_names = np.array([f'Team {i:04d}' for i in range(self.n_teams)], dtype=object)
+        # Starter of each team and position is player 2k, its substitute 2k + 1
+        self.player_names = np.array([f'Player{i:05d}' for i in range(self.n_teams * len(POSITIONS) * 2)], dtype=object)
+        self.start = pd.Timestamp('2024-01-08').value
+        self.span = max(30, n_games * 365 // GAMES_PER_YEAR) * 86400 * 10**9
+
+def _schedule(league, n_games, rng):
+    # Game dates in order, league of each game and its blue/red teams
+    dates = np.sort(league.start + rng.integers(0, league.span, n_games)) // (60 * 10**9) * (60 * 10**9)
+    leagues = rng.integers(0, league.n_leagues, n_games)
+    blue = rng.integers(0, TEAMS_PER_LEAGUE, n_games)
+    red = (blue + rng.integers(1, TEAMS_PER_LEAGUE, n_games)) % TEAMS_PER_LEAGUE
+    teams = np.stack([blue, red], axis=1) + leagues[:, None] * TEAMS_PER_LEAGUE
+    return dates, leagues, teams
+
+def _chunk(league, first_game, dates, leagues, teams, rng):
+    n = len(dates)
+    shape = (n, 2, len(POSITIONS))
+    pos = np.broadcast_to(np.arange(len(POSITIONS)), shape)
+    team = np.broadcast_to(teams[:, :, None], shape)
+    minutes_g = np.clip(rng.normal(31.5, 5.5, n), 18.0, 55.0)
+    diff = league.strength[teams[:, 0]] - league.strength[teams[:, 1]]
+    blue_wins = rng.random(n) < 1 / (1 + np.exp(-(diff + 0.1)))
+    result_t = np.stack([blue_wins, ~blue_wins], axis=1).astype(np.float64)
+    minutes_t = np.repeat(minutes_g[:, None], 2, axis=1)
+
+    # Team level outcomes
+    kills_t = rng.poisson(minutes_t * (0.32 + 0.14 * result_t + 0.04 * np.stack([diff, -diff], axis=1)).clip(0.05))
+    deaths_t = kills_t[:, ::-1]
+    dragons_t = rng.poisson(1.2 + 1.3 * result_t)
+    barons_t = rng.binomial(2, 0.15 + 0.45 * result_t)
+    heralds_t = rng.binomial(2, 0.35 + 0.25 * result_t)
+    inhibitors_t = rng.poisson(0.2 + 1.6 * result_t)
+    firsts = {}
+    for name, p in [('firstblood', 0.55), ('firstdragon', 0.6), ('firstherald', 0.6), ('firsttower', 0.7),
+                    ('firstmidtower', 0.65), ('firsttothreetowers', 0.8)]:
+        blue_first = rng.random(n) < np.where(blue_wins, p, 1 - p)
+        firsts[name] = np.stack([blue_first, ~blue_first], axis=1).astype(np.float64)
+
+    # Player level stats, splitting team totals by position
+    kills = np.stack([rng.multinomial(kills_t[:, s], KILL_SHARE) for s in range(2)], axis=1)
+    deaths = np.stack([rng.multinomial(deaths_t[:, s], DEATH_SHARE) for s in range(2)], axis=1)
+    assists = rng.binomial((kills_t[:, :, None] - kills).clip(0), np.broadcast_to(ASSIST_RATE, shape))
+    minutes = np.broadcast_to(minutes_g[:, None, None], shape)
+    win = np.broadcast_to(result_t[:, :, None], shape)
+    noise = lambda scale: rng.lognormal(0.0, scale, shape)
+    cspm = CSPM[pos] * noise(0.12) * (1 + 0.05 * win)
+    earned_gpm = EARNED_GPM[pos] * noise(0.1) * (1 + 0.18 * win)
+    dpm = DPM[pos] * noise(0.25) * (1 + 0.08 * win)
+    dtpm = DTPM[pos] * noise(0.2) * (1 - 0.05 * win)
+    vspm = VSPM[pos] * noise(0.2)
+    earnedgold = earned_gpm * minutes
+    damage = dpm * minutes
+    total_cs = np.round(cspm * minutes)
+
+    cols = {}
+    cols['gameid'] = np.repeat([f'SYNTH01_{g:07d}' for g in range(first_game, first_game + n)], 10)
+    cols['datacompleteness'] = np.repeat(np.where(league.partial[leagues], 'partial', 'complete'), 10)
+    cols['league'] = np.repeat(league.league_names[leagues], 10)
+    years = pd.to_datetime(dates).year.to_numpy()
+    cols['year'] = np.repeat(years, 10)
+    cols['split'] = np.repeat(np.where(pd.to_datetime(dates).month < 6, 'Spring', 'Summer'), 10)
+    cols['playoffs'] = np.repeat((pd.to_datetime(dates).month % 6 == 4).astype(np.int64), 10)
+    cols['date'] = np.repeat(pd.to_datetime(dates).strftime('%Y-%m-%d %H:%M:%S').to_numpy(), 10)
+    cols['game'] = np.repeat(rng.integers(1, 4, n), 10)
+    cols['patch'] = np.repeat(np.round(14.01 + (pd.to_datetime(dates).dayofyear.to_numpy() // 14) / 100, 2), 10)
+    cols['participantid'] = np.tile(np.arange(1, 11), n)
+    cols['side'] = np.tile(np.repeat(['Blue', 'Red'], 5), n)
+    cols['position'] = np.tile(POSITIONS * 2, n)
+    player = (team * len(POSITIONS) + pos) * 2 + (rng.random(shape) < SUB_RATE)
+    names = league.player_names[player].reshape(-1)
+    names[rng.random(names.shape) < UNKNOWN_PLAYER_RATE] = 'unknown player'
+    cols['playername'] = names
+    cols['playerid'] = np.char.add('oe:player:', player.reshape(-1).astype(str))
+    cols['teamname'] = league.team_names[team].reshape(-1)
+    cols['teamid'] = np.char.add('oe:team:', team.reshape(-1).astype(str))
+    cols['champion'] = np.array([f'Champion{c:03d}' for c in range(160)], dtype=object)[rng.integers(0, 160, n * 10)]
+
+    flat = lambda a: np.broadcast_to(a, shape).reshape(-1).astype(np.float64)
+    team_stat = lambda a: flat(np.asarray(a, dtype=np.float64)[:, :, None])
+    stats = {
+        'gamelength': team_stat(np.round(minutes_t * 60)),
+        'result': team_stat(result_t),
+        'kills': flat(kills), 'deaths': flat(deaths), 'assists': flat(assists),
+        'teamkills': team_stat(kills_t), 'teamdeaths': team_stat(deaths_t),
+        'team kpm': team_stat(kills_t / minutes_t), 'ckpm': team_stat((kills_t + deaths_t) / minutes_t),
+        'dragons': team_stat(dragons_t), 'barons': team_stat(barons_t), 'heralds': team_stat(heralds_t),
+        'inhibitors': team_stat(inhibitors_t),
+        'firstbloodassist': flat(rng.random(shape) < 0.25 * firsts['firstblood'][:, :, None]),
+        'damagetochampions': flat(np.round(damage)), 'dpm': flat(dpm),
+        'damageshare': flat(damage / damage.sum(axis=2, keepdims=True)),
+        'damagetakenperminute': flat(dtpm),
+        'visionscore': flat(np.round(vspm * minutes)), 'vspm': flat(vspm),
+        'totalgold': flat(np.round(earnedgold + 500 + 1.6 * 60 * minutes)),
+        'earnedgold': flat(np.round(earnedgold)), 'earned gpm': flat(earned_gpm),
+        'earnedgoldshare': flat(earnedgold / earnedgold.sum(axis=2, keepdims=True)),
+        'total cs': flat(total_cs), 'cspm': flat(cspm),
+    }
+    stats.update({name: team_stat(v) for name, v in firsts.items()})
+    team_gold = earnedgold.sum(axis=2)
+    stats['gspd'] = team_stat((team_gold - team_gold[:, ::-1]) / (team_gold + team_gold[:, ::-1]))
+    stats['gpr'] = team_stat((team_gold - team_gold[:, ::-1]) / 1000 * np.sign(result_t - 0.5) * 0.3)
+
+    # @10/15/20/25 snapshots, empty past the end of the game and in partial leagues
+    partial = np.repeat(league.partial[leagues], 10)
+    for t in (10, 15, 20, 25):
+        played = flat(minutes >= t) > 0
+        frac = np.clip(t / minutes, 0.0, 1.0)
+        snap = {
+            f'goldat{t}': np.round(500 + earned_gpm * 0.85 * t + 120 * t),
+            f'killsat{t}': rng.binomial(kills, frac * 0.8),
+            f'deathsat{t}': rng.binomial(deaths, frac * 0.8),
+            f'assistsat{t}': rng.binomial(assists, frac * 0.8),
+        }
+        cs = np.round(cspm * 0.9 * t)
+        snap[f'golddiffat{t}'] = snap[f'goldat{t}'] - snap[f'goldat{t}'][:, ::-1]
+        snap[f'csdiffat{t}'] = cs - cs[:, ::-1]
+        if t == 25:
+            xp = np.round((420 + 35 * win) * t * noise(0.08))
+            snap['xpat25'] = xp
+            snap['xpdiffat25'] = xp - xp[:, ::-1]
+        for name, v in snap.items():
+            stats[name] = np.where(played & ~partial, flat(v), np.nan)
+    for name in STATS:
+        cols[name] = stats[name]
+    cols['total cs'] = stats['total cs']
+    return pd.DataFrame(cols)
+
+def iter_chunks(n_games, seed=0):
+    """Yield the generated rows in date order, CHUNK_GAMES games at a time.
+
+    The output depends only on n_games and seed.
+    """
+    rng = np.random.default_rng(seed)
+    league = _League(n_games, rng)
+    dates, leagues, teams = _schedule(league, n_games, rng)
+    for start in range(0, n_games, CHUNK_GAMES):
+        end = min(start + CHUNK_GAMES, n_games)
+        chunk_rng = np.random.default_rng([seed, start])
+        yield _chunk(league, start, dates[start:end], leagues[start:end], teams[start:end], chunk_rng)
+
+def generate(n_games, seed=0):
+    # Whole generated frame in memory, as read from the CSV by pd.read_csv
+    return pd.concat(iter_chunks(n_games, seed), ignore_index=True)
+
+def write_csv(n_games, path, seed=0):
+    for i, chunk in enumerate(iter_chunks(n_games, seed)):
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic OraclesElixir-shaped match CSV')
+    parser.add_argument('games', type=int, help='Number of games (10 rows each)')
+    parser.add_argument('output', type=str, help='Output CSV path')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+    write_csv(args.games, args.output, args.seed)
+
+if __name__ == '__main__':
+    main()
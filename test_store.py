@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data
+import synthetic
+from features import feature_keys, feature_windows
+from store import FeatureStore
+
+FEATURES = ['feat_kills', 'feat_opp_kills', 'feat_ewm10g_kills', 'feat_last5_kills', 'feat_opp_ewm30d_deaths']
+
+@pytest.fixture(scope='module')
+def matches(tmp_path_factory):
+    path = synthetic.write_csv(400, str(tmp_path_factory.mktemp('data') / 'matches.csv'), seed=1)
+    return data.read_data(path, cache=False)
+
+def _sorted_state(store):
+    return {kind: frame.sort_index().sort_index(axis=1) for kind, frame in store.state.items()}
+
+def test_save_load_ingest_matches_single_pass(matches, tmp_path):
+    full = FeatureStore(windows=feature_windows(FEATURES))
+    expected = full.ingest(matches, 'kills', FEATURES)
+
+    cut = matches['date'].quantile(0.6)
+    store = FeatureStore(str(tmp_path / 'store'), windows=feature_windows(FEATURES))
+    store.ingest(matches[matches['date'] <= cut], 'kills', FEATURES)
+    store.save()
+    reloaded = FeatureStore(str(tmp_path / 'store'))
+    got = reloaded.ingest(matches, 'kills', FEATURES)
+    reloaded.save()
+
+    key = ['gameid', 'participantid']
+    expected = expected[expected['date'] > cut].sort_values(key).reset_index(drop=True)
+    got = got.sort_values(key).reset_index(drop=True)
+    assert len(got) > 0
+    pd.testing.assert_frame_equal(got[key], expected[key])
+    np.testing.assert_allclose(got[FEATURES].to_numpy(dtype=np.float64), expected[FEATURES].to_numpy(dtype=np.float64))
+
+    again = FeatureStore(str(tmp_path / 'store'))
+    assert again.high_water_mark == full.high_water_mark
+    assert again.gameids == full.gameids
+    for kind, frame in _sorted_state(full).items():
+        pd.testing.assert_frame_equal(_sorted_state(again)[kind], frame, check_dtype=False)
+
+def test_interrupted_save_keeps_previous_generation(matches, tmp_path, monkeypatch):
+    path = str(tmp_path / 'store')
+    cut = matches['date'].quantile(0.5)
+    store = FeatureStore(path, windows=feature_windows(FEATURES))
+    store.ingest(matches[matches['date'] <= cut], 'kills', FEATURES)
+    store.save()
+    saved = FeatureStore(path)
+
+    store.ingest(matches, 'kills', FEATURES)
+    def crash(*args, **kwargs):
+        raise OSError('disk full')
+    # State files of the new generation are written, its meta.json is not
+    monkeypatch.setattr('store.json.dump', crash)
+    with pytest.raises(OSError):
+        store.save()
+    monkeypatch.undo()
+
+    after = FeatureStore(path)
+    assert after.gameids == saved.gameids
+    assert after.high_water_mark == saved.high_water_mark
+    for kind, frame in _sorted_state(saved).items():
+        pd.testing.assert_frame_equal(_sorted_state(after)[kind], frame)
+
+def test_snapshot_of_features_projection(matches):
+    # What interactive.current_snapshot does with the frame its load_data projects to features.txt
+    features = data.get_features(os.path.join(os.path.dirname(__file__), 'features.txt'))
+    projected = matches[data.columns_for_features(features, [])]
+    snapshot = FeatureStore(windows=feature_windows(features))
+    snapshot.ingest(projected, features=[])
+    full = FeatureStore(windows=feature_windows(features))
+    full.ingest(matches, features=[])
+    assert snapshot.players() == full.players() and snapshot.teams() == full.teams()
+
+    last = matches[matches['date'] == matches['date'].max()].iloc[0]
+    game = data._game_from_df(matches[matches['gameid'] == last['gameid']], last)
+    game.date = matches['date'].max() + pd.Timedelta(days=1)
+    np.testing.assert_allclose(snapshot.latest(game, features), full.latest(game, features))
+
+def test_game_at_high_water_mark_gets_features(matches, tmp_path):
+    full = FeatureStore(windows=feature_windows(FEATURES))
+    expected = full.ingest(matches, 'kills', FEATURES)
+    # A time several games started at, with only one of them ingested first
+    games_at = matches.groupby('date')['gameid'].nunique()
+    date = games_at[games_at > 1].index[-1]
+    first_game = matches.loc[matches['date'] == date, 'gameid'].iloc[0]
+    first = matches[(matches['date'] < date) | (matches['gameid'] == first_game)]
+    store = FeatureStore(windows=feature_windows(FEATURES))
+    store.ingest(first, 'kills', FEATURES)
+    assert store.high_water_mark == date
+
+    got = store.ingest(matches[matches['date'] <= date], 'kills', FEATURES)
+    # Rows sharing a player or opponent key with the first game would see it in the state
+    at = matches[matches['date'] == date]
+    keys = feature_keys(at)
+    clash = np.zeros(len(at), dtype=bool)
+    for index in keys.values():
+        clash |= index.isin(list(index[(at['gameid'] == first_game).to_numpy()]))
+    rows = at.loc[~clash, ['gameid', 'participantid']]
+    want = expected.merge(rows, on=['gameid', 'participantid'])
+    assert len(want) > 0 and clash[(at['gameid'] != first_game).to_numpy()].any()
+    key = ['gameid', 'participantid']
+    got, want = got.sort_values(key).reset_index(drop=True), want.sort_values(key).reset_index(drop=True)
+    pd.testing.assert_frame_equal(got[key], want[key])
+    np.testing.assert_allclose(got[FEATURES].to_numpy(dtype=np.float64), want[FEATURES].to_numpy(dtype=np.float64))